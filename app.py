@@ -2,11 +2,35 @@ import streamlit as st
 import requests
 import json
 from bs4 import BeautifulSoup
+import lxml.html
 import openai
 import math
-
-openai.api_key = st.secrets["OPENAI_API_KEY"]
-client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+import csv
+import io
+import gzip
+import xml.etree.ElementTree as ET
+import re
+import bisect
+import asyncio
+import functools
+import hashlib
+import itertools
+import logging
+import queue
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+import os
+import sys
+import types
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 # -----------------------------------
 # 1. CONFIGURATION
@@ -14,19 +38,30 @@ client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
 VALID_USERNAME    = "admin"
 VALID_PASSWORD    = "shop1"
-SHOP_NAME         = "kinzav2.myshopify.com"
+SHOP_NAME         = os.environ.get("SHOPIFY_SHOP", "kinzav2.myshopify.com")
 
 # Use a valid Shopify Admin API version (e.g. "2023-10" or "2024-01"):
 API_VERSION       = "2025-01"
 
-
-ACCESS_TOKEN = st.secrets["SHOPIFY_ACCESS_TOKEN"]
-
+def get_secret(name):
+    """A secret from the environment, falling back to .streamlit/secrets.toml. Read on use, not at import."""
+    value = os.environ.get(name)
+    if value:
+        return value
+    try:
+        return st.secrets[name]
+    except Exception as exc:
+        raise RuntimeError(f"{name} is not set in the environment or .streamlit/secrets.toml") from exc
 
 LOCATION_ID         = "gid://shopify/Location/91287421246"
 PRODUCT_CATEGORY_ID = "gid://shopify/TaxonomyCategory/aa-1-4"
 DEFAULT_STOCK       = 8
 
+# Store prices: the source price times PRICE_MARKUP, rounded up to a
+# multiple of PRICE_ROUND_TO (None keeps the exact amount)
+PRICE_MARKUP   = 1.0
+PRICE_ROUND_TO = None
+
 # Hard-coded FAQ page reference
 FAQ_PAGE_GLOBAL_ID = "gid://shopify/OnlineStorePage/687485878651"
 
@@ -34,19 +69,693 @@ FAQ_PAGE_GLOBAL_ID = "gid://shopify/OnlineStorePage/687485878651"
 WE_CARE_PAGE_GLOBAL_ID = "gid://shopify/OnlineStorePage/127953174846"
 DISCLAIMER_PAGE_GLOBAL_ID = "gid://shopify/OnlineStorePage/127935152446"
 
-GRAPHQL_ENDPOINT  = f"https://{SHOP_NAME}/admin/api/{API_VERSION}/graphql.json"
-HEADERS           = {
-    "X-Shopify-Access-Token": ACCESS_TOKEN,
-    "Content-Type": "application/json"
-}
+GRAPHQL_ENDPOINT  = (os.environ.get("SHOPIFY_GRAPHQL_ENDPOINT")   # e.g. a local stand-in (bench/)
+                     or f"https://{SHOP_NAME}/admin/api/{API_VERSION}/graphql.json")
+
+def shopify_headers():
+    return {
+        "X-Shopify-Access-Token": get_secret("SHOPIFY_ACCESS_TOKEN"),
+        "Content-Type": "application/json"
+    }
+
+# Batch runs: how many products are scraped/enhanced/uploaded at once
+DEFAULT_WORKERS   = 6
+MAX_WORKERS       = 16
+
+# HTTP transport shared by scraping, sitemap and Admin API calls
+HTTP_TIMEOUT      = (5, 30)   # (connect, read) seconds
+HTTP_POOL_SIZE    = 32        # keep-alive connections kept per host
+HTTP_RETRIES      = 4
+HTTP_BACKOFF      = 0.5       # seconds, doubled per retry and jittered
+HTTP_USER_AGENT   = "Mozilla/5.0"
+
+# On-disk caches (scraped responses, and later GPT output) live here
+CACHE_DIR               = os.environ.get("UPLOADER_CACHE_DIR", ".cache")
+SCRAPE_CACHE_MAX_BYTES  = 512 * 1024 * 1024
+SCRAPE_CACHE_MAX_AGE    = 6 * 3600   # reuse responses without validators for this long
+
+# GPT product descriptions
+DEFAULT_LINK                = "/collections/all"   # used when no store URL matches a name
+DESCRIPTION_MODEL           = "gpt-4o"
+DESCRIPTION_MAX_TOKENS      = 1500
+DESCRIPTION_TEMPERATURE     = 0.7
+DESCRIPTION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DESCRIPTION_CACHE_TTL       = 30 * 24 * 3600   # None keeps cached descriptions forever
+
+# Async description stage: defaults for the concurrency / rate limits shown in the UI
+OPENAI_BASE_URL      = os.environ.get("OPENAI_BASE_URL")   # e.g. a local OpenAI-compatible server
+LLM_CONCURRENCY      = 16
+LLM_RPM_LIMIT        = 500
+LLM_TPM_LIMIT        = 150_000
+LLM_MAX_RETRIES      = 6
+
+# Offline description batches (Batch API)
+DESCRIPTION_BATCH_POLL_INTERVAL = 30
+DESCRIPTION_BATCH_TIMEOUT       = 24 * 3600
+
+# Storefront sitemap used to build description links
+SITEMAP_ROOT            = "https://signaturelabels.co.uk/sitemap.xml"
+SITEMAP_WORKERS         = 8
+
+# Pre-flight lookup of existing products by handle. Nested connections multiply
+# in the query cost: 10 products + 10 x 50 variants is ~510 points, well under
+# Shopify's 1,000-point cap for a single query
+PREFLIGHT_CHUNK              = 100   # URLs resolved per pre-flight round
+PREFLIGHT_HANDLES_PER_QUERY  = 10    # handles per products(query:) search
+PREFLIGHT_VARIANTS_PAGE      = 50    # variants fetched with each product; any more are paged in
+
+# Product images
+IMAGE_MAX           = 10                 # images uploaded per product
+IMAGE_MIN_BYTES     = 10 * 1024          # smaller files are thumbnails or placeholders
+IMAGE_MAX_BYTES     = 20 * 1024 * 1024   # Shopify's limit for an image file
+IMAGE_CONTENT_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif")
+IMAGE_CHECK_WORKERS = 8                  # concurrent HEAD / range requests per product
+IMAGE_CHECK_TTL     = 7 * 24 * 3600      # reuse a URL's check result for this long
+
+# Deferred publishing / collection membership
+COLLECTION_ADD_CHUNK = 250   # product IDs per collectionAddProducts call
+DEFERRED_CHECKPOINT  = 250   # finished products between deferred flushes
+
+# Collection crawling via the storefront's products.json
+COLLECTION_PAGE_SIZE    = 250   # Shopify's maximum `limit`
+COLLECTION_PAGE_WORKERS = 4     # pages fetched concurrently
+
+# Shopify query-cost throttling (defaults until the API reports the real bucket)
+DEFAULT_BUCKET_SIZE  = 1000
+DEFAULT_RESTORE_RATE = 50
+DEFAULT_QUERY_COST   = 50   # reservation for a query we haven't seen a cost for yet
+THROTTLE_MAX_RETRIES = 8
+
+# Collections, tags, pages and publications are cached for this long (seconds)
+STORE_METADATA_TTL   = 900
+
+# Aliased mutation batching: Shopify rejects single queries above 1000 points
+BATCH_MAX_COST  = 900
+MUTATION_COST   = 10
+
+# Bulk operations (bulk write mode)
+BULK_POLL_INTERVAL = 5      # seconds between status checks
+BULK_TIMEOUT       = 4 * 3600
+
+# Background jobs (uploads run off the Streamlit script thread)
+JOB_RUNNER_SLOTS  = 2   # jobs running at once; further submissions wait in the queue
+JOB_POLL_INTERVAL = 2   # seconds between job panel refreshes
+JOB_HISTORY       = 50  # finished jobs kept for the status panel
+LEDGER_TTL        = 7 * 24 * 3600   # ledger jobs untouched this long can no longer be resumed
 
 
 # -----------------------------------
-# 2. LOGIN
+# 1b. STATUS MESSAGES
+# -----------------------------------
+
+# Worker threads can't draw on the page, so while a product is processed in
+# the pool its messages are collected and shown in the aggregated results.
+# Outside a Streamlit session (CLI, library use) messages go to logging.
+_report_local = threading.local()
+log = logging.getLogger("uploader")
+
+LOG_LEVELS = {"info": logging.INFO, "success": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+def report(level, message):
+    """Send a status message ('info', 'success', 'warning', 'error')."""
+    sink = getattr(_report_local, "sink", None)
+    if sink is not None:
+        sink.append((level, message))
+    elif get_script_run_ctx() is None:
+        log.log(LOG_LEVELS[level], message)
+    else:
+        getattr(st, level)(message)
+
+# -----------------------------------
+# 1b2. METRICS
+# -----------------------------------
+# A run's Metrics object travels in opts["metrics"]. Work done inside
+# measure(opts, url, stage) is timed, and the HTTP requests, Shopify query
+# cost and LLM tokens it causes are counted against that product and stage.
+
+_metrics_local = threading.local()
+
+class Metrics:
+    """Wall time and counters of one run, per stage and per product."""
+
+    def __init__(self):
+        self.started  = time.time()
+        self.last     = None    # time of the most recent finished product
+        self.statuses = {}      # result status -> products
+        self.stages   = {}      # stage -> {"seconds": [...], counter: total}
+        self.products = {}      # product url -> {"status", "seconds": {stage: s}, counter: total}
+        self._lock    = threading.Lock()
+
+    def _product(self, product_url):
+        return self.products.setdefault(product_url, {"status": None, "seconds": {}})
+
+    def observe(self, product_url, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, {"seconds": []})["seconds"].append(seconds)
+            if product_url:
+                times = self._product(product_url)["seconds"]
+                times[stage] = times.get(stage, 0) + seconds
+
+    def add(self, product_url, stage, name, value=1):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"seconds": []})
+            totals[name] = totals.get(name, 0) + value
+            if product_url:
+                product = self._product(product_url)
+                product[name] = product.get(name, 0) + value
+
+    def finish(self, result):
+        """Record a finished product from its batch result."""
+        with self._lock:
+            self.last = time.time()
+            self.statuses[result["status"]] = self.statuses.get(result["status"], 0) + 1
+            self._product(result["url"])["status"] = result["status"]
+
+    def summary(self):
+        with self._lock:
+            done    = sum(self.statuses.values())
+            elapsed = max((self.last or time.time()) - self.started, 1e-6)
+            stages  = {}
+            for stage, totals in self.stages.items():
+                seconds = sorted(totals["seconds"])
+                stages[stage] = {
+                    "count":         len(seconds),
+                    "p50":           _percentile(seconds, 0.50),
+                    "p95":           _percentile(seconds, 0.95),
+                    "total_seconds": round(sum(seconds), 3),
+                    **{k: v for k, v in totals.items() if k != "seconds"},
+                }
+            return {
+                "products":            done,
+                "statuses":            dict(self.statuses),
+                "elapsed_seconds":     round(elapsed, 3),
+                "products_per_minute": round(done / elapsed * 60, 2),
+                "stages":              stages,
+            }
+
+    def to_json(self):
+        with self._lock:
+            products = json.loads(json.dumps(self.products))
+        return json.dumps({"summary": self.summary(), "products": products}, indent=2)
+
+    def to_prometheus(self):
+        """Run aggregates in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            "# HELP uploader_stage_seconds Wall time of a product stage.",
+            "# TYPE uploader_stage_seconds summary",
+        ]
+        counters = {}
+        for stage, s in sorted(summary["stages"].items()):
+            # Stages with counters but no timings (e.g. cache hits) have no quantiles
+            if s["count"]:
+                lines += [
+                    f'uploader_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50"]}',
+                    f'uploader_stage_seconds{{stage="{stage}",quantile="0.95"}} {s["p95"]}',
+                ]
+            lines += [
+                f'uploader_stage_seconds_sum{{stage="{stage}"}} {s["total_seconds"]}',
+                f'uploader_stage_seconds_count{{stage="{stage}"}} {s["count"]}',
+            ]
+            for name in set(s) - {"count", "p50", "p95", "total_seconds"}:
+                counters.setdefault(name, []).append(f'uploader_{name}_total{{stage="{stage}"}} {s[name]}')
+        for name, samples in sorted(counters.items()):
+            lines += [f"# TYPE uploader_{name}_total counter", *samples]
+        lines.append("# TYPE uploader_products_total counter")
+        lines += [f'uploader_products_total{{status="{k}"}} {v}' for k, v in sorted(summary["statuses"].items())]
+        lines += ["# TYPE uploader_products_per_minute gauge",
+                  f"uploader_products_per_minute {summary['products_per_minute']}"]
+        return "\n".join(lines) + "\n"
+
+def _percentile(values, q):
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)], 3)
+
+def stage_scope(opts, product_url, stage):
+    metrics = (opts or {}).get("metrics")
+    return (metrics, product_url, stage) if metrics is not None else None
+
+@contextmanager
+def measure(opts, product_url, stage):
+    """Time `stage` of a product and attribute the counters recorded inside it."""
+    scope = stage_scope(opts, product_url, stage)
+    saved = getattr(_metrics_local, "scope", None)
+    _metrics_local.scope = scope
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        _metrics_local.scope = saved
+        observe(scope, time.monotonic() - started)
+
+def observe(scope, seconds):
+    if scope:
+        metrics, product_url, stage = scope
+        metrics.observe(product_url, stage, seconds)
+
+def count(name, value=1, scope=None):
+    """Add to a counter of the current stage (or of `scope`, off the worker thread)."""
+    scope = scope or getattr(_metrics_local, "scope", None)
+    if scope and value:
+        metrics, product_url, stage = scope
+        metrics.add(product_url, stage, name, value)
+
+# -----------------------------------
+# 1c. HTTP TRANSPORT
+# -----------------------------------
+
+# Process-wide singletons. st.cache_resource only reads and writes its cache
+# inside a script run, so upload workers, background jobs and the CLI would
+# each get a fresh session / throttle / cache from it. The registry lives in
+# a module of its own, which script reruns don't re-execute.
+_resource_module = sys.modules.setdefault("_uploader_resources", types.ModuleType("_uploader_resources"))
+_RESOURCES     = _resource_module.__dict__.setdefault("registry", {})
+_RESOURCE_LOCK = _resource_module.__dict__.setdefault("lock", threading.RLock())
+
+def shared_resource(factory):
+    """Cache a zero-argument factory's result for the whole process (see above)."""
+    key = f"{factory.__module__}.{factory.__qualname__}"
+
+    @functools.wraps(factory)
+    def get():
+        with _RESOURCE_LOCK:
+            if key not in _RESOURCES:
+                _RESOURCES[key] = factory()
+            return _RESOURCES[key]
+
+    get.clear = lambda: _RESOURCES.pop(key, None)
+    return get
+
+class JitteredRetry(Retry):
+    """Exponential backoff with jitter, so parallel workers don't retry in lockstep."""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+@shared_resource
+def get_http_session():
+    """
+    One pooled keep-alive session for every outbound request: connections to
+    Shopify and the source storefronts are reused instead of re-handshaking.
+    GET/HEAD are retried on connection errors, 429 and 5xx (honouring
+    Retry-After); POSTs only on connection errors, since a mutation may
+    already have been applied.
+    """
+    retry = JitteredRetry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # gzip/deflate, plus br when the brotli package is installed
+    session.headers.update(make_headers(accept_encoding=True))
+    session.headers["User-Agent"] = HTTP_USER_AGENT
+    return session
+
+def _count_response(res, streamed):
+    count("requests")
+    retries = getattr(res.raw, "retries", None)
+    count("retries", len(retries.history) if retries else 0)
+    body = res.request.body or b""
+    count("bytes", len(body) + (0 if streamed else len(res.content)))
+
+def http_get(url, **kwargs):
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    res = get_http_session().get(url, **kwargs)
+    _count_response(res, kwargs.get("stream"))
+    return res
+
+def http_head(url, **kwargs):
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    res = get_http_session().head(url, **kwargs)
+    _count_response(res, True)
+    return res
+
+def http_post(url, **kwargs):
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    res = get_http_session().post(url, **kwargs)
+    _count_response(res, kwargs.get("stream"))
+    return res
+
+class DiskCache:
+    """
+    Size-bounded SQLite key/value store shared by all threads. Entries carry a
+    JSON `meta` dict; the least recently used ones are evicted once the store
+    grows past `max_bytes`, and entries older than `ttl` seconds expire.
+    """
+
+    def __init__(self, path, max_bytes, ttl=None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl       = ttl
+        self._lock     = threading.Lock()
+        self._conn     = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB, meta TEXT,"
+            " size INTEGER, created REAL, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        """(value, meta, created) for a live entry, else None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, meta, created, size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, meta, created, size = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total -= size
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return value, json.loads(meta or "{}"), created
+
+    def put(self, key, value, meta=None):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, meta, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, json.dumps(meta or {}), len(value), now, now)
+            )
+            self._total += len(value) - (old[0] if old else 0)
+            self._evict()
+
+    def touch(self, key):
+        """Mark an entry as freshly validated (resets its age)."""
+        with self._lock:
+            now = time.time()
+            self._conn.execute("UPDATE entries SET created = ?, accessed = ? WHERE key = ?", (now, now, key))
+
+    def delete(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total -= row[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._total = 0
+
+    def _evict(self):
+        # Trim to 90% so a full cache doesn't evict on every put
+        target = self.max_bytes * 0.9
+        while self._total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed LIMIT 200"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total -= size
+                if self._total <= target:
+                    return
+
+@shared_resource
+def get_scrape_cache():
+    return DiskCache(os.path.join(CACHE_DIR, "scrape.sqlite"), SCRAPE_CACHE_MAX_BYTES)
+
+def response_validators(res):
+    return {"etag": res.headers.get("ETag"), "last_modified": res.headers.get("Last-Modified")}
+
+def conditional_headers(validators):
+    """If-None-Match / If-Modified-Since for validators saved by response_validators."""
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+def cached_get(url, max_age=SCRAPE_CACHE_MAX_AGE):
+    """
+    GET a storefront URL through the scrape cache.
+    Cached responses are revalidated with If-None-Match / If-Modified-Since;
+    ones without validators are reused for `max_age` seconds.
+    Returns (body_bytes, changed) where `changed` is False when the cached
+    copy was still valid.
+    """
+    cache = get_scrape_cache()
+    entry = cache.get(url)
+    headers = {}
+    if entry:
+        body, meta, created = entry
+        headers = conditional_headers(meta)
+        if not headers and time.time() - created < max_age:
+            return body, False
+
+    res = http_get(url, headers=headers, verify=False)
+    if res.status_code == 304 and entry:
+        cache.touch(url)
+        return entry[0], False
+    res.raise_for_status()
+    cache.put(url, res.content, response_validators(res))
+    return res.content, True
+
+# -----------------------------------
+# 1d. SHOPIFY GRAPHQL CLIENT
+# -----------------------------------
+
+class CostThrottle:
+    """
+    Client-side mirror of Shopify's leaky bucket, shared by every thread.
+    Each call reserves its expected cost before it is sent; the reservation is
+    reconciled with `extensions.cost` (requestedQueryCost / actualQueryCost /
+    throttleStatus) once the response arrives.
+    """
+
+    def __init__(self, maximum=DEFAULT_BUCKET_SIZE, restore_rate=DEFAULT_RESTORE_RATE):
+        self.maximum      = float(maximum)
+        self.restore_rate = float(restore_rate)
+        self.available    = float(maximum)
+        self._stamp       = time.monotonic()
+        self._estimates   = {}
+        self._lock        = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.maximum, self.available + (now - self._stamp) * self.restore_rate)
+        self._stamp = now
+
+    def estimate(self, query):
+        with self._lock:
+            return self._estimates.get(query, DEFAULT_QUERY_COST)
+
+    def acquire(self, cost):
+        """Block until `cost` points are available, then reserve them."""
+        while True:
+            with self._lock:
+                cost = min(cost, self.maximum)
+                self._refill()
+                if self.available >= cost:
+                    self.available -= cost
+                    return cost
+                delay = (cost - self.available) / self.restore_rate
+            time.sleep(delay)
+
+    def settle(self, query, reserved, cost, throttled=False):
+        """Reconcile a reservation with the cost block Shopify returned."""
+        with self._lock:
+            self._refill()
+            if not cost:
+                # No cost info (e.g. transport error): assume nothing was spent
+                self.available = min(self.maximum, self.available + reserved)
+                return
+            if cost.get("requestedQueryCost") is not None:
+                self._estimates[query] = cost["requestedQueryCost"]
+            # A throttled call costs nothing; otherwise refund what wasn't used
+            spent = 0 if throttled else cost.get("actualQueryCost", reserved) or 0
+            self.available = min(self.maximum, self.available + reserved - spent)
+
+            status = cost.get("throttleStatus") or {}
+            if status:
+                self.maximum      = float(status.get("maximumAvailable", self.maximum))
+                self.restore_rate = float(status.get("restoreRate", self.restore_rate))
+                # Shopify can't see our in-flight reservations, so trust the lower figure
+                self.available = min(self.available, float(status.get("currentlyAvailable", self.available)))
+
+@shared_resource
+def get_shopify_throttle():
+    """One bucket per store, shared across sessions and reruns."""
+    return CostThrottle()
+
+def _is_throttled(resp):
+    return any(
+        (e.get("extensions") or {}).get("code") == "THROTTLED"
+        for e in resp.get("errors") or []
+        if isinstance(e, dict)
+    )
+
+def graphql_mutation(input_payload, expected_cost=None):
+    """
+    POST a query/mutation to the Admin API, pacing it against the store's
+    query-cost bucket and retrying THROTTLED / 429 responses.
+    `expected_cost` overrides the reservation for a query not seen before.
+    """
+    throttle = get_shopify_throttle()
+    query = input_payload.get("query", "")
+    resp = {}
+    for attempt in range(THROTTLE_MAX_RETRIES + 1):
+        estimate = throttle.estimate(query) if expected_cost is None else expected_cost
+        reserved = throttle.acquire(estimate)
+        try:
+            res = http_post(GRAPHQL_ENDPOINT, headers=shopify_headers(), json=input_payload, verify=False)
+        except Exception:
+            throttle.settle(query, reserved, None)
+            raise
+        if res.status_code == 429:
+            count("throttled")
+            throttle.settle(query, reserved, None)
+            time.sleep(float(res.headers.get("Retry-After", 1)))
+            continue
+        if res.status_code >= 500 and not query.lstrip().startswith("mutation"):
+            # Reads are safe to repeat; mutations are not (they may have applied)
+            throttle.settle(query, reserved, None)
+            time.sleep(HTTP_BACKOFF * 2 ** attempt)
+            continue
+
+        resp = res.json()
+        cost = (resp.get("extensions") or {}).get("cost")
+        count("shopify_cost", (cost or {}).get("actualQueryCost") or (cost or {}).get("requestedQueryCost") or 0)
+        if _is_throttled(resp):
+            count("throttled")
+            throttle.settle(query, reserved, cost, throttled=True)
+            if not (cost or {}).get("throttleStatus"):
+                time.sleep(1)
+            continue
+        throttle.settle(query, reserved, cost)
+        return resp
+
+    report("error", f"Shopify API still throttled after {THROTTLE_MAX_RETRIES} retries")
+    return resp
+
 # -----------------------------------
+# 1e. ALIASED MUTATION BATCHING
+# -----------------------------------
+
+class GraphQLBatcher:
+    """
+    Packs many mutations into aliased GraphQL documents, e.g.
+
+        mutation($v0_id: ID!, $v0_input: InventoryItemInput!, ...) {
+          v0: inventoryItemUpdate(id: $v0_id, input: $v0_input) { userErrors { field message } }
+          v1: ...
+        }
+
+    split into chunks that stay under BATCH_MAX_COST. Top-level mutation
+    fields run in order, so operations queued for one item apply in the order
+    they were added. With `auto_flush` a full chunk is sent as soon as it is
+    queued, so one batcher can be shared by every product of a run.
+    """
+
+    def __init__(self, max_cost=BATCH_MAX_COST, op_cost=MUTATION_COST, auto_flush=False):
+        self.op_cost    = op_cost
+        self.chunk_size = max(1, max_cost // op_cost)
+        self.auto_flush = auto_flush
+        self.errors     = {}    # key -> userErrors, for every flushed op that failed
+        self._ops       = []
+        self._sending   = set()   # keys of the chunk being sent
+        self._lock      = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ops)
+
+    def pending_keys(self):
+        """Keys of the ops queued or still being sent."""
+        with self._lock:
+            return {op[0] for op in self._ops} | self._sending
+
+    def add(self, key, field, args, selection="userErrors { field message }"):
+        """
+        Queue `field(args) { selection }`. `args` maps argument name to a
+        (graphql_type, value) pair; `key` identifies the op in `errors`.
+        """
+        self.add_many([(key, field, args, selection)])
+
+    def add_many(self, ops):
+        """Queue several (key, field, args[, selection]) ops back to back."""
+        with self._lock:
+            for op in ops:
+                key, field, args = op[:3]
+                selection = op[3] if len(op) > 3 else "userErrors { field message }"
+                self._ops.append((key, field, args, selection))
+            full = self.auto_flush and len(self._ops) >= self.chunk_size
+        if full:
+            self.flush(full_chunks_only=True)
+
+    def flush(self, full_chunks_only=False):
+        """Send queued ops; returns {key: userErrors} for the ops sent that failed."""
+        failed = {}
+        with self._send_lock:
+            while True:
+                with self._lock:
+                    if not self._ops or (full_chunks_only and len(self._ops) < self.chunk_size):
+                        break
+                    chunk = self._ops[:self.chunk_size]
+                    del self._ops[:self.chunk_size]
+                    self._sending = {op[0] for op in chunk}
+                chunk_failed = self._send(chunk)
+                with self._lock:
+                    self.errors.update(chunk_failed)
+                    self._sending = set()
+                failed.update(chunk_failed)
+        return failed
+
+    def _send(self, chunk):
+        var_defs, fields, variables = [], [], {}
+        for n, (_key, field, args, selection) in enumerate(chunk):
+            arg_list = []
+            for name, (gql_type, value) in args.items():
+                var = f"v{n}_{name}"
+                var_defs.append(f"${var}: {gql_type}")
+                arg_list.append(f"{name}: ${var}")
+                variables[var] = value
+            fields.append(f"v{n}: {field}({', '.join(arg_list)}) {{ {selection} }}")
+        query = f"mutation({', '.join(var_defs)}) {{\n  " + "\n  ".join(fields) + "\n}"
 
-if "logged_in" not in st.session_state:
-    st.session_state.logged_in = False
+        try:
+            resp = graphql_mutation({"query": query, "variables": variables},
+                                    expected_cost=len(chunk) * self.op_cost)
+        except Exception as exc:
+            return {key: [{"message": str(exc)}] for key, *_ in chunk}
+
+        data = resp.get("data") or {}
+        top_errors = resp.get("errors") or []
+        failed = {}
+        for n, (key, *_rest) in enumerate(chunk):
+            alias = f"v{n}"
+            errors = list((data.get(alias) or {}).get("userErrors") or [])
+            errors += [e for e in top_errors if (e.get("path") or [None])[0] == alias]
+            if data.get(alias) is None and not errors:
+                errors = top_errors or [{"message": "No result returned"}]
+            if errors:
+                failed[key] = errors
+        return failed
+
+# -----------------------------------
+# 2. LOGIN
+# -----------------------------------
 
 def login_screen():
     st.title("🔒 Login")
@@ -55,6 +764,7 @@ def login_screen():
     if st.button("Login"):
         if u == VALID_USERNAME and p == VALID_PASSWORD:
             st.session_state.logged_in = True
+            st.session_state.username  = u
             st.experimental_rerun()
         else:
             st.error("Invalid credentials")
@@ -68,19 +778,58 @@ def logout_button():
 # 3. SCRAPING COLLECTION / PRODUCT
 # -----------------------------------
 
-def scrape_collection(url):
-    st.info(f"Scraping collection: {url}")
-    res = requests.get(url, headers={"User-Agent":"Mozilla/5.0"}, verify=False)
-    res.raise_for_status()
-    soup = BeautifulSoup(res.text, "html.parser")
-    domain = url.split('/')[2]
-    product_urls = []
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme or 'https'}://{parts.netloc}"
+
+def fetch_collection_page(origin, handle, page):
+    """Product handles on one page of the storefront's /collections/{handle}/products.json."""
+    body, _changed = cached_get(
+        f"{origin}/collections/{handle}/products.json?limit={COLLECTION_PAGE_SIZE}&page={page}"
+    )
+    return [p["handle"] for p in json.loads(body)["products"]]
+
+def crawl_collection_json(url):
+    """
+    Enumerate a whole collection through products.json, fetching
+    COLLECTION_PAGE_WORKERS pages at a time until a short page marks the end.
+    """
+    origin = _origin(url)
+    handle = urlsplit(url).path.split("/collections/", 1)[1].split("/")[0]
+    product_urls = {}   # ordered set
+    page = 1
+    with ThreadPoolExecutor(max_workers=COLLECTION_PAGE_WORKERS) as pool:
+        while True:
+            pages = range(page, page + COLLECTION_PAGE_WORKERS)
+            batches = list(pool.map(lambda n: fetch_collection_page(origin, handle, n), pages))
+            for batch in batches:
+                for h in batch:
+                    product_urls.setdefault(f"{origin}/products/{h}")
+            if any(len(batch) < COLLECTION_PAGE_SIZE for batch in batches):
+                return list(product_urls)
+            page += COLLECTION_PAGE_WORKERS
+
+def scrape_collection_html(url):
+    """Fallback: product links on the collection's first HTML page."""
+    body, _changed = cached_get(url)
+    soup = BeautifulSoup(body, "html.parser")
+    product_urls = {}   # ordered set
     for a in soup.find_all('a', href=True):
         if "/products/" in a['href']:
-            link = f"https://{domain}{a['href'].split('?')[0]}"
-            if link not in product_urls:
-                product_urls.append(link)
-    st.success(f"Found {len(product_urls)} products.")
+            product_urls.setdefault(urljoin(url, a['href'].split('?')[0]))
+    return list(product_urls)
+
+def scrape_collection(url):
+    report("info", f"Scraping collection: {url}")
+    product_urls = []
+    if "/collections/" in url:
+        try:
+            product_urls = crawl_collection_json(url)
+        except Exception as exc:
+            report("warning", f"products.json unavailable ({exc}), falling back to HTML")
+    if not product_urls:
+        product_urls = scrape_collection_html(url)
+    report("success", f"Found {len(product_urls)} products.")
     return product_urls
 
 
@@ -88,47 +837,50 @@ def scrape_collection(url):
 
 
 
-def scrape_product(url):
-    st.info(f"Scraping product: {url}")
-    res = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, verify=False)
-    res.raise_for_status()
-    soup = BeautifulSoup(res.text, "html.parser")
+def _load_json_script(text):
+    try:
+        loaded = json.loads(text)
+    except Exception:
+        return {}
+    if isinstance(loaded, list) and loaded:
+        return loaded[0] if isinstance(loaded[0], dict) else {}
+    return loaded if isinstance(loaded, dict) else {}
+
+def _https(src):
+    return "https:" + src if src.startswith("//") else src
+
+def extract_product_html(html):
+    """
+    Targeted extraction from a product page: only the ModelJson-template /
+    LD+JSON scripts and the photoswipe carousel images are looked at, via lxml
+    XPath instead of a full BeautifulSoup walk.
+    Returns (product_data, carousel_image_urls).
+    """
+    tree = lxml.html.fromstring(html)
 
     # ─── 1. THEME JSON PARSING ───────────────────────────────────────────────────
     product_data = {}
-    model_tag = soup.find(
-        "script",
-        {"type": "application/json",
-         "id":   lambda x: x and x.startswith("ModelJson-template")}
-    )
-    if model_tag and model_tag.string:
-        try:
-            loaded = json.loads(model_tag.string)
-            if isinstance(loaded, list) and loaded:
-                product_data = loaded[0]
-            elif isinstance(loaded, dict):
-                product_data = loaded
-        except Exception:
-            product_data = {}
+    for node in tree.xpath('//script[@type="application/json"][starts-with(@id, "ModelJson-template")]'):
+        product_data = _load_json_script(node.text or "")
+        break
 
     if not product_data:
         # Fallback to LD+JSON
-        ld = soup.find("script", type="application/ld+json")
-        try:
-            product_data = json.loads(ld.string) if ld and ld.string else {}
-        except Exception:
-            product_data = {}
-
-    title       = product_data.get("name", "No Title")
-    description = product_data.get("description", "")
-    handle      = url.split("/products/")[-1].split("?")[0]
-    vendor      = url.split('/')[2].split('.')[0].capitalize()
-
-    # ─── 2. IMAGE EXTRACTION ──────────────────────────────────────────────────────
-    # 2a) Try the proper 'images' array first
+        for node in tree.xpath('//script[@type="application/ld+json"]'):
+            product_data = _load_json_script(node.text or "")
+            break
+
+    # ─── 2. FLICKITY CAROUSEL IMAGES ─────────────────────────────────────────────
+    carousel = []
+    for img in tree.xpath('//img[contains(concat(" ", normalize-space(@class), " "), " photoswipe__image ")]'):
+        src = img.get("data-photoswipe-src") or img.get("src")
+        if src:
+            carousel.append(_https(src))
+    return product_data, carousel
+
+def _theme_json_images(product_data):
+    """The 'images' array of theme / LD+JSON data, or its singular 'image' entry."""
     raw_images = product_data.get("images") or []
-
-    # 2b) If that isn't a list, normalise singular 'image' entry
     if not isinstance(raw_images, list):
         raw_images = []
         single = product_data.get("image")
@@ -136,97 +888,236 @@ def scrape_product(url):
             raw_images = [single]
         elif isinstance(single, dict) and single.get("src"):
             raw_images = [single["src"]]
+    return raw_images
 
-    # 2c) If still empty, fall back to the Flickity carousel in the HTML
-    if not raw_images:
-        for img in soup.select("img.photoswipe__image"):
-            src = img.get("data-photoswipe-src") or img.get("src")
-            if not src:
-                continue
-            if src.startswith("//"):
-                src = "https:" + src
-            raw_images.append(src)
-
-    # 2d) Trim down to your usual maximum
-    images = raw_images[:10]
+def dynamic_pricing(original_price):
+    """Store price for a source price, per PRICE_MARKUP / PRICE_ROUND_TO."""
+    price = round(original_price * PRICE_MARKUP, 2)
+    if PRICE_ROUND_TO:
+        price = math.ceil(price / PRICE_ROUND_TO) * PRICE_ROUND_TO
+    return price
 
-    # ─── 3. VARIANTS VIA .js ENDPOINT ────────────────────────────────────────────
+def variant_rows(js_variants):
+    """Size, adjusted price, compare-at price and SKU for each variant of a .js payload."""
     variants = []
-    try:
-        domain   = url.split('/')[2]
-        vres     = requests.get(
-            f"https://{domain}/products/{handle}.js",
-            headers={"User-Agent": "Mozilla/5.0"}, verify=False
-        )
-        var_json = vres.json()
-        for v in var_json.get("variants", []):
-            size_label     = v.get("public_title") or v.get("title") or "Default"
-            original_price = float(v["price"]) / 100
-            adjusted_price = dynamic_pricing(original_price)
-            compare_at     = (f"{float(v['compare_at_price'])/100:.2f}"
-                               if v.get("compare_at_price") else None)
-
-            variants.append({
-                "size":           size_label,
-                "price":          f"{adjusted_price:.2f}",
-                "compareAtPrice": compare_at,
-                "sku":            v.get("sku", "")
-            })
-    except Exception:
-        st.warning("Failed to fetch variant info")
+    for v in js_variants:
+        size_label     = v.get("public_title") or v.get("title") or "Default"
+        original_price = float(v["price"]) / 100
+        adjusted_price = dynamic_pricing(original_price)
+        compare_at     = (f"{float(v['compare_at_price'])/100:.2f}"
+                           if v.get("compare_at_price") else None)
+
+        variants.append({
+            "size":           size_label,
+            "price":          f"{adjusted_price:.2f}",
+            "compareAtPrice": compare_at,
+            "sku":            v.get("sku", "")
+        })
+    return variants
 
-    return {
-        "handle":          handle,
-        "title":           f"{vendor} | {title}",
-        "raw_description": description,
-        "vendor":          vendor,
-        "variants":        variants,
-        "images":          images
-    }
+def product_handle(url):
+    return url.split("/products/")[-1].split("?")[0].rstrip("/")
 
-    # ─── 3. VARIANTS VIA .js ENDPOINT (unchanged) ─────────────────────────────
-    variants = []
+def fetch_product_js(url, max_age=SCRAPE_CACHE_MAX_AGE):
+    """
+    The storefront's /products/{handle}.js payload for a product URL, and
+    whether it changed since it was last cached.
+    """
+    handle = product_handle(url)
+    body, changed = cached_get(f"{_origin(url)}/products/{handle}.js", max_age)
+    return json.loads(body), changed
+
+def scrape_product(url):
+    """
+    Scrape a product, using the /products/{handle}.js payload as the primary
+    source (title, description, images and variants in one request). The HTML
+    page is only fetched when the payload is missing a title or images.
+    """
+    report("info", f"Scraping product: {url}")
+    handle = product_handle(url)
+    vendor = url.split('/')[2].split('.')[0].capitalize()
+    cache  = get_scrape_cache()
+
+    # ─── 1. .js ENDPOINT ─────────────────────────────────────────────────────────
+    title, description, images, variants = None, "", [], []
     try:
-        domain   = url.split('/')[2]
-        vres     = requests.get(
-            f"https://{domain}/products/{handle}.js",
-            headers={"User-Agent": "Mozilla/5.0"}, verify=False
-        )
-        var_json = vres.json()
-        for v in var_json.get("variants", []):
-            size_label     = v.get("public_title") or v.get("title") or "Default"
-            original_price = float(v["price"]) / 100
-            adjusted_price = dynamic_pricing(original_price)
-            compare_at     = (f"{float(v['compare_at_price'])/100:.2f}"
-                               if v.get("compare_at_price") else None)
-
-            variants.append({
-                "size":           size_label,
-                "price":          f"{adjusted_price:.2f}",
-                "compareAtPrice": compare_at,
-                "sku":            v.get("sku", "")
-            })
+        js, changed = fetch_product_js(url)
+        # Unchanged payload: reuse the product parsed from it last time
+        parsed = None if changed else cache.get(f"product:{url}")
+        if parsed:
+            return json.loads(parsed[0])
+        title       = js.get("title")
+        description = js.get("description") or ""
+        images      = [_https(src) for src in js.get("images") or [] if isinstance(src, str)]
+        variants    = variant_rows(js.get("variants", []))
     except Exception:
-        st.warning("Failed to fetch variant info")
+        report("warning", "Failed to fetch variant info")
 
+    # ─── 2. HTML FALLBACK FOR MISSING FIELDS ─────────────────────────────────────
+    if not title or not images:
+        body, _changed = cached_get(url)
+        product_data, carousel = extract_product_html(body)
+        title       = title or product_data.get("name")
+        description = description or product_data.get("description", "")
+        images      = images or _theme_json_images(product_data) or carousel
 
-    return {
+    product = {
         "handle":          handle,
-        "title":           f"{vendor} | {title}",
+        "title":           f"{vendor} | {title or 'No Title'}",
         "raw_description": description,
         "vendor":          vendor,
         "variants":        variants,
         "images":          images
     }
+    if variants:
+        cache.put(f"product:{url}", json.dumps(product))
+    return product
+
+# -----------------------------------
+# 3b. PRODUCT IMAGES
+# -----------------------------------
+# Scraped image lists repeat the same picture at several CDN sizes and can
+# hold thumbnails or dead links. Only reachable, unique, full-size images
+# are handed to productSet / productCreateMedia.
+
+# Shopify CDN size variants: name_1024x1024.jpg, name_x800@2x.jpg, name_600x_crop_center.jpg, name_grande.jpg
+_IMAGE_SIZE_SUFFIX = re.compile(
+    r"_(?:(\d+)x(\d*)|x(\d+)|pico|icon|thumb|small|compact|medium|large|grande|original|master)"
+    r"(?:_crop_[a-z]+)?(?:@(\d)x)?(?=\.[A-Za-z0-9]+$)"
+)
+_IMAGE_SIZE_PARAMS = {"v", "width", "height", "crop"}
+
+def canonical_image_url(src):
+    """
+    (canonical URL, width) of an image URL. On the Shopify CDN the size
+    suffix and sizing / version parameters are stripped, which leaves the
+    original upload; `width` is the variant's pixel width (None for originals).
+    """
+    parts = urlsplit(_https(src))
+    path, width = parts.path, None
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "v"]
+    if parts.netloc == "cdn.shopify.com" or parts.path.startswith("/cdn/shop/"):
+        match = _IMAGE_SIZE_SUFFIX.search(path)
+        if match:
+            path  = path[:match.start()] + path[match.end():]
+            width = int(match.group(1) or match.group(2) or match.group(3) or 0) * int(match.group(4) or 1)
+        query = [(k, v) for k, v in query if k not in _IMAGE_SIZE_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, path, urlencode(query), "")), width
+
+def image_candidates(urls):
+    """
+    Group image URLs by canonical image, in first-seen order. Each group lists
+    the URLs to try best-first: the original, then the sized variants seen,
+    largest first.
+    """
+    groups = {}
+    for src in urls:
+        if not isinstance(src, str) or not src.strip():
+            continue
+        canonical, width = canonical_image_url(src.strip())
+        if width is not None:
+            groups.setdefault(canonical, {})[_https(src.strip())] = width
+        else:
+            groups.setdefault(canonical, {})
+    return [[canonical] + sorted(variants, key=variants.get, reverse=True)
+            for canonical, variants in groups.items()]
+
+def _probe_image(url):
+    """(ok, reason, cacheable) from a HEAD request, or a 1-byte range GET where HEAD isn't answered."""
+    try:
+        res = http_head(url, allow_redirects=True, verify=False)
+        if res.status_code in (403, 405, 501) or "Content-Length" not in res.headers:
+            res = http_get(url, headers={"Range": "bytes=0-0"}, stream=True, verify=False)
+            res.close()
+    except requests.RequestException as exc:
+        return False, f"unreachable ({type(exc).__name__})", False
+    if res.status_code >= 400:
+        return False, f"HTTP {res.status_code}", res.status_code < 500
+
+    content_type = res.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type not in IMAGE_CONTENT_TYPES:
+        return False, f"content type {content_type or 'missing'}", True
+    if res.status_code == 206:
+        size = res.headers.get("Content-Range", "").rpartition("/")[2]
+    else:
+        size = res.headers.get("Content-Length", "")
+    if size.isdigit() and not IMAGE_MIN_BYTES <= int(size) <= IMAGE_MAX_BYTES:
+        return False, f"{int(size)} bytes", True
+    return True, None, True
+
+def check_image(url):
+    """(ok, reason) for an image URL; definite answers are cached for IMAGE_CHECK_TTL."""
+    cache = get_scrape_cache()
+    entry = cache.get(f"image:{url}")
+    if entry and time.time() - entry[2] < IMAGE_CHECK_TTL:
+        return tuple(json.loads(entry[0]))
+    ok, reason, cacheable = _probe_image(url)
+    if cacheable:
+        cache.put(f"image:{url}", json.dumps([ok, reason]))
+    return ok, reason
+
+def select_images(urls, limit=IMAGE_MAX):
+    """
+    The first `limit` unique images of `urls` that pass check_image, each at
+    its best available size. Groups are checked concurrently.
+    """
+    scope = getattr(_metrics_local, "scope", None)
+
+    def first_good(candidates):
+        _metrics_local.scope = scope
+        reason = None
+        for url in candidates:
+            ok, why = check_image(url)
+            if ok:
+                return url, None
+            reason = reason or why
+        return None, reason
+
+    groups = image_candidates(urls)
+    with ThreadPoolExecutor(max_workers=IMAGE_CHECK_WORKERS) as pool:
+        checked = list(pool.map(first_good, groups))
+
+    selected = [url for url, _reason in checked if url][:limit]
+    dropped  = [(group[0], reason) for group, (url, reason) in zip(groups, checked) if not url]
+    for url, reason in dropped:
+        report("warning", f"Skipping image {url}: {reason}")
+    if len(groups) < len(urls):
+        report("info", f"{len(urls) - len(groups)} duplicate image URLs collapsed")
+    return selected
 
 # -----------------------------------
 # 4. FETCH COLLECTIONS & TAGS
 # -----------------------------------
+# Store metadata is cached for STORE_METADATA_TTL and shared by every
+# session, so reruns and per-product steps don't query it again. Failed
+# loads raise inside the cached functions, so errors are never cached.
 
-def fetch_collections_and_tags():
+def _paginate(query, connection_path, page_size=250, variables=None, after=None):
+    """
+    Yield every edge of a connection, following cursors (from `after`, if given).
+    `query` takes $first / $after (plus any extra `variables`);
+    `connection_path` is the key path to the connection.
+    """
+    while True:
+        resp = graphql_mutation({"query": query, "variables": {
+            **(variables or {}), "first": page_size, "after": after
+        }})
+        conn = resp.get("data")
+        for key in connection_path:
+            conn = (conn or {}).get(key)
+        if conn is None:
+            raise RuntimeError(resp.get("errors") or resp)
+        yield from conn["edges"]
+        if not conn["pageInfo"]["hasNextPage"]:
+            return
+        after = conn["pageInfo"]["endCursor"]
+
+@st.cache_data(ttl=STORE_METADATA_TTL, show_spinner=False)
+def load_collections():
     query = """
-    {
-      collections(first:100) {
+    query($first: Int!, $after: String) {
+      collections(first: $first, after: $after) {
+        pageInfo { hasNextPage endCursor }
         edges {
           node {
             id
@@ -239,8 +1130,17 @@ def fetch_collections_and_tags():
           }
         }
       }
+    }
+    """
+    return list(_paginate(query, ["collections"]))
+
+@st.cache_data(ttl=STORE_METADATA_TTL, show_spinner=False)
+def load_product_tags():
+    query = """
+    query($first: Int!, $after: String) {
       shop {
-        productTags(first:250) {
+        productTags(first: $first, after: $after) {
+          pageInfo { hasNextPage endCursor }
           edges {
             node
           }
@@ -248,50 +1148,82 @@ def fetch_collections_and_tags():
       }
     }
     """
-    resp = requests.post(GRAPHQL_ENDPOINT, headers=HEADERS, json={"query":query}, verify=False).json()
-    if "data" not in resp:
-        st.error(f"Error fetching collections/tags: {resp}")
+    return sorted(t["node"] for t in _paginate(query, ["shop", "productTags"]))
+
+@st.cache_data(ttl=STORE_METADATA_TTL, show_spinner=False)
+def load_pages():
+    query = """
+    query($first: Int!, $after: String) {
+      pages(first: $first, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        edges {
+          node {
+            id
+            title
+          }
+        }
+      }
+    }
+    """
+    return [{"id": p["node"]["id"], "title": p["node"]["title"]} for p in _paginate(query, ["pages"])]
+
+@st.cache_data(ttl=STORE_METADATA_TTL, show_spinner=False)
+def load_publication_ids():
+    query = """
+    query($first: Int!, $after: String) {
+      publications(first: $first, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        edges {
+          node {
+            id
+          }
+        }
+      }
+    }
+    """
+    return [e["node"]["id"] for e in _paginate(query, ["publications"])]
+
+def clear_store_metadata_cache():
+    """Drop cached collections, tags, pages and publications for every session."""
+    for loader in (load_collections, load_product_tags, load_pages, load_publication_ids):
+        loader.clear()
+
+def fetch_collections_and_tags():
+    try:
+        cols = load_collections()
+        tag_list = load_product_tags()
+    except Exception as exc:
+        report("error", f"Error fetching collections/tags: {exc}")
         return [], []
-    
-    cols = resp["data"]["collections"]["edges"]
+
     # A "manual" collection has no rules
     manual = [c for c in cols if not (c["node"].get("ruleSet") or {}).get("rules")]
-
-    tag_edges = resp["data"]["shop"]["productTags"]["edges"]
-    tag_list  = sorted(t["node"] for t in tag_edges)
     return manual, tag_list
 
+def get_publication_ids():
+    try:
+        return load_publication_ids()
+    except Exception as exc:
+        report("error", f"Error fetching publications: {exc}")
+        return []
+
 # -----------------------------------
 # 4b. FETCH & FILTER PAGES (GRAPHQL)
 # -----------------------------------
 
 def fetch_and_filter_pages():
     """
-    Fetch up to 50 pages using GraphQL.
+    Fetch every page using GraphQL (cached).
     Return two lists:
       1) delivery_pages -> pages whose title starts with 'Delivery'
       2) size_pages -> pages whose title contains 'size'
     """
-    query = """
-    {
-      pages(first:50) {
-        edges {
-          node {
-            id
-            title
-          }
-        }
-      }
-    }
-    """
-    resp = requests.post(GRAPHQL_ENDPOINT, headers=HEADERS, json={"query":query}, verify=False).json()
-    if "data" not in resp or "pages" not in resp["data"]:
-        st.error("Unable to fetch pages. Ensure read_content scope is granted.")
+    try:
+        all_pages = load_pages()
+    except Exception:
+        report("error", "Unable to fetch pages. Ensure read_content scope is granted.")
         return [], []
 
-    edges = resp["data"]["pages"]["edges"]
-    all_pages = [{"id": p["node"]["id"], "title": p["node"]["title"]} for p in edges]
-
     # Filter for pages whose title starts with "Delivery"
     delivery_pages = [p for p in all_pages if p["title"].lower().startswith("delivery")]
     # Filter for pages containing "size"
@@ -303,36 +1235,47 @@ def fetch_and_filter_pages():
 # 5. CREATE PRODUCT WITH VARIANTS
 # -----------------------------------
 
-def create_product_with_variants(product_data):
-    mutation = """
-    mutation productSet($product: ProductSetInput!) {
-      productSet(input: $product) {
-        product {
-          id
-          variants(first:50) {
-            edges {
-              node {
-                id
-                inventoryItem {
-                  id
-                }
-              }
-            }
-          }
-        }
-        userErrors {
-          field
-          message
-        }
-      }
-    }
-    """
+def page_reference_metafields(d_id=None, s_id=None):
+    """The custom.* page references every uploaded product carries."""
+    refs = [
+        ("faqs",            FAQ_PAGE_GLOBAL_ID),
+        ("we_care_for_you", WE_CARE_PAGE_GLOBAL_ID),
+        ("disclaimer",      DISCLAIMER_PAGE_GLOBAL_ID),
+    ]
+    if d_id:
+        refs.append(("delivery_time", d_id))
+    if s_id:
+        refs.append(("suffuse_casual_pret_size_chart", s_id))
+    return [
+        {"namespace": "custom", "key": key, "type": "page_reference", "value": value}
+        for key, value in refs
+    ]
 
+def media_sources(product_data):
+    """Image URLs of a scraped product (plain URLs or {'originalSource': ...} dicts)."""
+    sources = []
+    for img in product_data.get("images", []):
+        src = img.get("originalSource") if isinstance(img, dict) else img
+        if src:
+            sources.append(_https(src))
+    return sources
+
+def build_product_set_input(product_data, opts=None):
+    """
+    Build the ProductSetInput for a scraped product.
+    With `opts` the input also carries everything productSet can write in the
+    same call: category, page-reference metafields, inventory tracking and
+    stock at LOCATION_ID, and the product images.
+    A product found by the pre-flight lookup (`existing`) is updated in
+    place: its ID and variant IDs are set, and its description, media and
+    stock levels are left as they are in the store.
+    """
+    existing = product_data.get("existing")
     sizes = list({v["size"] for v in product_data["variants"]})
     product_input = {
         "title":             product_data["title"],
         "handle":            product_data["handle"],
-        "descriptionHtml":   product_data.get("enhanced_description", product_data["raw_description"]),  # ✅ Use GPT-enhanced description if available
+        "descriptionHtml":   product_data.get("enhanced_description") or product_data["raw_description"],  # ✅ Use GPT-enhanced description if available
         "vendor":            product_data["vendor"],
         "productType":       product_data["productType"],
         "tags":              product_data.get("tags", []),
@@ -345,6 +1288,10 @@ def create_product_with_variants(product_data):
         ],
         "variants": []
     }
+    if existing:
+        product_input["id"] = existing["id"]
+        del product_input["descriptionHtml"]
+        existing_variant_ids = {ev["size"]: ev["id"] for ev in existing["variants"]}
 
     for v in product_data["variants"]:
         variant_entry = {
@@ -355,21 +1302,69 @@ def create_product_with_variants(product_data):
             variant_entry["compareAtPrice"] = v["compareAtPrice"]
         if v["sku"]:
             variant_entry["sku"] = v["sku"]
+        if existing and v["size"] in existing_variant_ids:
+            variant_entry["id"] = existing_variant_ids[v["size"]]
+        if opts is not None:
+            variant_entry["inventoryItem"] = {"tracked": True}
+            if not existing:
+                variant_entry["inventoryQuantities"] = [
+                    {"locationId": LOCATION_ID, "name": "available", "quantity": DEFAULT_STOCK}
+                ]
         product_input["variants"].append(variant_entry)
 
+    if opts is not None:
+        product_input["category"]   = PRODUCT_CATEGORY_ID
+        product_input["metafields"] = page_reference_metafields(opts.get("del_id"), opts.get("siz_id"))
+    if opts is not None and not existing:
+        product_input["files"] = [
+            {"originalSource": src, "contentType": "IMAGE", "alt": product_data["title"]}
+            for src in media_sources(product_data)
+        ]
+    return product_input
+
+def create_product_with_variants(product_data, opts=None):
+    """
+    Create the product via productSet; see build_product_set_input for what
+    passing `opts` adds. Returns (product_id, inventory_item_ids).
+    """
+    mutation = """
+    mutation productSet($product: ProductSetInput!) {
+      productSet(input: $product) {
+        product {
+          id
+          variants(first:50) {
+            edges {
+              node {
+                id
+                inventoryItem {
+                  id
+                }
+              }
+            }
+          }
+        }
+        userErrors {
+          field
+          message
+        }
+      }
+    }
+    """
+
+    product_input = build_product_set_input(product_data, opts)
     payload = {"query": mutation, "variables": {"product": product_input}}
-    response = requests.post(GRAPHQL_ENDPOINT, headers=HEADERS, json=payload, verify=False).json()
+    response = graphql_mutation(payload)
 
-    product_set = response.get("data", {}).get("productSet", {})
+    product_set = (response.get("data") or {}).get("productSet") or {}
     errors      = product_set.get("userErrors", [])
     product_obj = product_set.get("product")
 
     if errors:
-        st.error(f"Create product errors: {errors}")
+        report("error", f"Create product errors: {errors}")
         return None, []
 
     if not product_obj or not product_obj.get("id"):
-        st.error("No product returned from API.")
+        report("error", f"No product returned from API. {response.get('errors', '')}")
         return None, []
 
     product_id = product_obj["id"]
@@ -381,9 +1376,6 @@ def create_product_with_variants(product_data):
 # 6. COMMON GRAPHQL + METAFIELD UPDATES
 # -----------------------------------
 
-def graphql_mutation(input_payload):
-    return requests.post(GRAPHQL_ENDPOINT, headers=HEADERS, json=input_payload, verify=False).json()
-
 def update_product_category(product_id):
     mutation = """
     mutation($i: ProductUpdateInput!) {
@@ -398,42 +1390,43 @@ def update_product_category(product_id):
     variables = {"i": {"id": product_id, "category": PRODUCT_CATEGORY_ID}}
     graphql_mutation({"query": mutation, "variables": variables})
 
-def enable_inventory_tracking(inventory_item_ids):
-    mutation = """
-    mutation($id: ID!, $input: InventoryItemInput!) {
-      inventoryItemUpdate(id: $id, input: $input) {
-        userErrors { field message }
-      }
-    }
-    """
-    for i in inventory_item_ids:
-        graphql_mutation({
-            "query": mutation,
-            "variables": {"id": i, "input": {"tracked": True}}
-        })
+def _report_batch_errors(label, failed):
+    for key, errors in failed.items():
+        report("warning", f"{label} error for {key}: {errors}")
 
-def activate_inventory(inventory_item_ids):
-    mutation = """
-    mutation($iid: ID!, $lid: ID!) {
-      inventoryActivate(inventoryItemId:$iid, locationId:$lid) {
-        userErrors { field message }
-      }
-    }
+def enable_inventory_tracking(inventory_item_ids, batcher=None):
     """
-    for i in inventory_item_ids:
-        graphql_mutation({
-            "query": mutation,
-            "variables": {"iid": i, "lid": LOCATION_ID}
-        })
-
-def set_inventory_quantity(inventory_item_ids):
-    mutation = """
-    mutation($input: InventorySetQuantitiesInput!) {
-      inventorySetQuantities(input: $input) {
-        userErrors { field message }
-      }
-    }
+    Turn on tracking for every variant. Sent as one aliased request, or queued
+    on `batcher` when a run-wide batcher is shared across products.
+    Returns the keys of the queued ops.
     """
+    own = batcher is None
+    batcher = GraphQLBatcher() if own else batcher
+    ops = [
+        (("tracking", i), "inventoryItemUpdate",
+         {"id": ("ID!", i), "input": ("InventoryItemInput!", {"tracked": True})})
+        for i in inventory_item_ids
+    ]
+    batcher.add_many(ops)
+    if own:
+        _report_batch_errors("Inventory tracking", batcher.flush())
+    return [op[0] for op in ops]
+
+def activate_inventory(inventory_item_ids, batcher=None):
+    """Activate every variant at LOCATION_ID; batched like enable_inventory_tracking."""
+    own = batcher is None
+    batcher = GraphQLBatcher() if own else batcher
+    ops = [
+        (("activate", i), "inventoryActivate",
+         {"inventoryItemId": ("ID!", i), "locationId": ("ID!", LOCATION_ID)})
+        for i in inventory_item_ids
+    ]
+    batcher.add_many(ops)
+    if own:
+        _report_batch_errors("Inventory activation", batcher.flush())
+    return [op[0] for op in ops]
+
+def set_inventory_quantity(inventory_item_ids, batcher=None):
     changes = [
         {"inventoryItemId": i, "locationId": LOCATION_ID, "quantity": DEFAULT_STOCK}
         for i in inventory_item_ids
@@ -444,7 +1437,20 @@ def set_inventory_quantity(inventory_item_ids):
         "ignoreCompareQuantity": True,
         "quantities": changes
     }
+    if batcher is not None:
+        key = ("quantities", tuple(inventory_item_ids))
+        batcher.add(key, "inventorySetQuantities", {"input": ("InventorySetQuantitiesInput!", input_data)})
+        return [key]
+
+    mutation = """
+    mutation($input: InventorySetQuantitiesInput!) {
+      inventorySetQuantities(input: $input) {
+        userErrors { field message }
+      }
+    }
+    """
     graphql_mutation({"query": mutation, "variables": {"input": input_data}})
+    return []
 
 def upload_media(product_id, product_data):
     mutation = """
@@ -457,13 +1463,10 @@ def upload_media(product_id, product_data):
       }
     }
     """
-    media_list = []
-    for img in product_data["images"]:
-        media_list.append({
-            "originalSource": img["originalSource"],
-            "mediaContentType": img["mediaContentType"],
-            "alt": img.get("altText", "")
-        })
+    media_list = [
+        {"originalSource": src, "mediaContentType": "IMAGE", "alt": product_data.get("title", "")}
+        for src in media_sources(product_data)
+    ]
     if media_list:
         graphql_mutation({"query": mutation, "variables": {"pid": product_id, "med": media_list}})
 
@@ -529,7 +1532,7 @@ def update_we_care_and_disclaimer(product_id):
     resp = graphql_mutation({"query": mutation, "variables": variables})
     user_errors = resp.get("data",{}).get("productUpdate",{}).get("userErrors",[])
     if user_errors:
-        st.warning(f"We Care + Disclaimer Metafield Error: {user_errors}")
+        report("warning", f"We Care + Disclaimer Metafield Error: {user_errors}")
 
 # Delivery Time + a separate size chart key
 def update_delivery_and_size_chart_metafields(product_id, d_id, s_id):
@@ -572,23 +1575,7 @@ def update_delivery_and_size_chart_metafields(product_id, d_id, s_id):
     resp = graphql_mutation({"query": mutation, "variables": variables})
     user_errors = resp.get("data",{}).get("productUpdate",{}).get("userErrors",[])
     if user_errors:
-        st.warning(f"Delivery/Size Chart Metafields Error: {user_errors}")
-
-def get_publication_ids():
-    query = """
-    {
-      publications(first:20) {
-        edges {
-          node {
-            id
-          }
-        }
-      }
-    }
-    """
-    resp = graphql_mutation({"query": query})
-    edges = resp.get("data",{}).get("publications",{}).get("edges",[])
-    return [e["node"]["id"] for e in edges]
+        report("warning", f"Delivery/Size Chart Metafields Error: {user_errors}")
 
 def publish_product(product_id, publication_ids):
     mutation = """
@@ -602,7 +1589,8 @@ def publish_product(product_id, publication_ids):
     variables = {"i": {"id": product_id, "productPublications": product_pubs}}
     graphql_mutation({"query": mutation, "variables": variables})
 
-def add_product_to_collections(product_id, coll_ids):
+def add_products_to_collection(collection_id, product_ids):
+    """Add up to COLLECTION_ADD_CHUNK products to one collection; returns its userErrors."""
     mutation = """
     mutation($id: ID!, $p: [ID!]!) {
       collectionAddProducts(id: $id, productIds: $p) {
@@ -610,55 +1598,411 @@ def add_product_to_collections(product_id, coll_ids):
       }
     }
     """
+    try:
+        resp = graphql_mutation({"query": mutation, "variables": {"id": collection_id, "p": product_ids}})
+    except Exception as exc:
+        return [{"message": str(exc)}]
+    result = (resp.get("data") or {}).get("collectionAddProducts")
+    if result is None:
+        return resp.get("errors") or [{"message": "No result returned"}]
+    return result.get("userErrors") or []
+
+def add_product_to_collections(product_id, coll_ids):
     for cid in coll_ids:
-        graphql_mutation({"query": mutation, "variables": {"id": cid, "p": [product_id]}})
+        add_products_to_collection(cid, [product_id])
+
+# -----------------------------------
+# 6b. BULK OPERATIONS
+# -----------------------------------
+
+BULK_PRODUCT_SET_MUTATION = """
+mutation productSet($input: ProductSetInput!) {
+  productSet(input: $input) {
+    product {
+      id
+      variants(first:50) {
+        edges {
+          node {
+            id
+            inventoryItem {
+              id
+            }
+          }
+        }
+      }
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
+def staged_upload_jsonl(path):
+    """Upload a JSONL variables file to Shopify's staged storage; returns its stagedUploadPath."""
+    mutation = """
+    mutation($input: [StagedUploadInput!]!) {
+      stagedUploadsCreate(input: $input) {
+        stagedTargets {
+          url
+          resourceUrl
+          parameters { name value }
+        }
+        userErrors { field message }
+      }
+    }
+    """
+    filename = os.path.basename(path)
+    resp = graphql_mutation({"query": mutation, "variables": {"input": [{
+        "resource":   "BULK_MUTATION_VARIABLES",
+        "filename":   filename,
+        "mimeType":   "text/jsonl",
+        "httpMethod": "POST",
+    }]}})
+    staged = (resp.get("data") or {}).get("stagedUploadsCreate") or {}
+    if staged.get("userErrors") or not staged.get("stagedTargets"):
+        raise RuntimeError(f"stagedUploadsCreate failed: {staged.get('userErrors') or resp}")
+
+    target = staged["stagedTargets"][0]
+    params = {p["name"]: p["value"] for p in target["parameters"]}
+    with open(path, "rb") as fh:
+        up = http_post(target["url"], data=params, files={"file": (filename, fh, "text/jsonl")})
+    up.raise_for_status()
+    return params.get("key") or target["resourceUrl"]
+
+def run_bulk_mutation(mutation, staged_upload_path):
+    """Start a bulk mutation; returns the BulkOperation ID."""
+    query = """
+    mutation($m: String!, $p: String!) {
+      bulkOperationRunMutation(mutation: $m, stagedUploadPath: $p) {
+        bulkOperation { id status }
+        userErrors { field message }
+      }
+    }
+    """
+    resp = graphql_mutation({"query": query, "variables": {"m": mutation, "p": staged_upload_path}})
+    run = (resp.get("data") or {}).get("bulkOperationRunMutation") or {}
+    if run.get("userErrors") or not run.get("bulkOperation"):
+        raise RuntimeError(f"bulkOperationRunMutation failed: {run.get('userErrors') or resp}")
+    return run["bulkOperation"]["id"]
+
+def poll_bulk_operation(operation_id, interval=None, timeout=None):
+    """
+    Wait for a bulk operation to finish; returns its final status fields.
+    `interval` / `timeout` default to BULK_POLL_INTERVAL / BULK_TIMEOUT.
+    """
+    interval = BULK_POLL_INTERVAL if interval is None else interval
+    timeout  = BULK_TIMEOUT if timeout is None else timeout
+    query = """
+    query($id: ID!) {
+      node(id: $id) {
+        ... on BulkOperation {
+          id
+          status
+          errorCode
+          objectCount
+          url
+          partialDataUrl
+        }
+      }
+    }
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        resp = graphql_mutation({"query": query, "variables": {"id": operation_id}})
+        op = (resp.get("data") or {}).get("node") or {}
+        if op.get("status") in ("COMPLETED", "FAILED", "CANCELED", "EXPIRED"):
+            return op
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Bulk operation {operation_id} still {op.get('status')} after {timeout}s")
+        time.sleep(interval)
+
+def iter_bulk_results(result_url):
+    """
+    Stream a bulk mutation result file line by line.
+    Yields (line_number, product_id, inventory_item_ids, user_errors), where
+    line_number is the 0-based line of the submitted variables file.
+    """
+    with http_get(result_url, stream=True) as res:
+        res.raise_for_status()
+        for raw in res.iter_lines():
+            if not raw:
+                continue
+            row = json.loads(raw)
+            product_set = (row.get("data") or {}).get("productSet") or {}
+            product_obj = product_set.get("product") or {}
+            errors = product_set.get("userErrors") or row.get("errors") or []
+            inv_ids = [
+                e["node"]["inventoryItem"]["id"]
+                for e in (product_obj.get("variants") or {}).get("edges", [])
+            ]
+            yield row.get("__lineNumber"), product_obj.get("id"), inv_ids, errors
+
+def bulk_product_set(jsonl_path):
+    """
+    Create products from a JSONL file of {"input": ProductSetInput} lines with
+    one bulk operation. Returns {line_number: (product_id, inventory_item_ids, user_errors)}.
+    """
+    staged_path  = staged_upload_jsonl(jsonl_path)
+    operation_id = run_bulk_mutation(BULK_PRODUCT_SET_MUTATION, staged_path)
+    report("info", f"Bulk operation started: {operation_id}")
+
+    op = poll_bulk_operation(operation_id)
+    result_url = op.get("url") or op.get("partialDataUrl")
+    if op["status"] != "COMPLETED":
+        report("error", f"Bulk operation {op['status']}: {op.get('errorCode')}")
+    if not result_url:
+        raise RuntimeError(f"Bulk operation {op['status']} without a result file ({op.get('errorCode')})")
+
+    return {line: (pid, inv, errs) for line, pid, inv, errs in iter_bulk_results(result_url)}
 
 # -----------------------------------
 # 7. MAIN APP
 # -----------------------------------
 
+def iter_sitemap(sitemap_url):
+    """
+    Stream ('url' | 'sitemap', loc, lastmod) entries from a sitemap or sitemap
+    index with iterparse, clearing parsed elements as it goes so memory stays
+    flat. Gzipped sitemaps (.xml.gz) are detected by their magic bytes.
+    """
+    with http_get(sitemap_url, stream=True, verify=False) as res:
+        res.raise_for_status()
+        yield from _iter_sitemap_response(res)
+
+def _iter_sitemap_response(res):
+    res.raw.decode_content = True   # undo any Content-Encoding
+    res.raw.auto_close = False      # let the buffered reader see EOF instead of a closed file
+    stream = io.BufferedReader(res.raw)
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream)
+
+    root = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event != "end":
+            continue
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if tag in ("url", "sitemap"):
+            fields = {c.tag.rsplit("}", 1)[-1]: (c.text or "").strip() for c in elem}
+            if fields.get("loc"):
+                yield tag, fields["loc"], fields.get("lastmod") or None
+            root.clear()
+
+def fetch_child_sitemap(loc, validators):
+    """
+    A child sitemap's (loc, lastmod) URL entries and its new validators, or
+    None when the server answers 304 to the stored ETag / Last-Modified.
+    """
+    with http_get(loc, stream=True, verify=False, headers=conditional_headers(validators)) as res:
+        if res.status_code == 304:
+            return None
+        res.raise_for_status()
+        entries = [(u, lm) for kind, u, lm in _iter_sitemap_response(res) if kind == "url"]
+        return entries, response_validators(res)
+
 def fetch_sitemap(sitemap_url):
-    res = requests.get(sitemap_url)
-    res.raise_for_status()
-    soup = BeautifulSoup(res.text, "xml")
-    urls = [loc.text for loc in soup.find_all('loc')]
-    return urls
+    return [loc for kind, loc, _lastmod in iter_sitemap(sitemap_url) if kind == "url"]
+
+class SitemapStore:
+    """
+    SQLite record of the storefront's sitemap: every child sitemap with the
+    lastmod and HTTP validators it was fetched at, and every URL with the
+    child it came from.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS children (sitemap TEXT PRIMARY KEY, lastmod TEXT, fetched REAL)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(children)")}
+        if "validators" not in columns:   # stores created before validators were kept
+            self._conn.execute("ALTER TABLE children ADD COLUMN validators TEXT")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sitemap TEXT, lastmod TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS urls_sitemap ON urls(sitemap)")
+
+    def child_lastmods(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT sitemap, lastmod FROM children"))
+
+    def child_validators(self, sitemap):
+        with self._lock:
+            row = self._conn.execute("SELECT validators FROM children WHERE sitemap = ?", (sitemap,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def replace_child(self, sitemap, lastmod, entries, validators=None):
+        """Swap in a child sitemap's (loc, lastmod) entries."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM urls WHERE sitemap = ?", (sitemap,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO urls (url, sitemap, lastmod) VALUES (?, ?, ?)",
+                ((loc, sitemap, lm) for loc, lm in entries)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO children (sitemap, lastmod, fetched, validators) VALUES (?, ?, ?, ?)",
+                (sitemap, lastmod, time.time(), json.dumps(validators or {}))
+            )
+            self._conn.execute("COMMIT")
+
+    def drop_children_except(self, keep):
+        with self._lock:
+            for (sitemap,) in self._conn.execute("SELECT sitemap FROM children").fetchall():
+                if sitemap not in keep:
+                    self._conn.execute("DELETE FROM urls WHERE sitemap = ?", (sitemap,))
+                    self._conn.execute("DELETE FROM children WHERE sitemap = ?", (sitemap,))
+
+    def iter_urls(self, pattern):
+        """URLs containing `pattern`, e.g. '/collections/'."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url FROM urls WHERE instr(url, ?) > 0 ORDER BY url", (pattern,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+@shared_resource
+def get_sitemap_store():
+    return SitemapStore(os.path.join(CACHE_DIR, "sitemap.sqlite"))
+
+def crawl_sitemap_index(root_url=SITEMAP_ROOT, store=None):
+    """
+    Bring the stored URL set up to date with the storefront's sitemap index.
+    Child sitemaps are fetched concurrently, and only when their lastmod
+    differs from the one stored. Children without a lastmod (Shopify's index
+    publishes none) are revalidated with their stored ETag / Last-Modified.
+    Returns the number of child sitemaps re-fetched and skipped.
+    """
+    store = store or get_sitemap_store()
+    children, direct = {}, []
+    for kind, loc, lastmod in iter_sitemap(root_url):
+        if kind == "sitemap":
+            children[loc] = lastmod
+        else:
+            direct.append((loc, lastmod))
+    if direct:
+        # The root is a plain sitemap rather than an index
+        store.replace_child(root_url, None, direct)
+        return 1, 0
+
+    known = store.child_lastmods()
+    stale = [loc for loc, lastmod in children.items() if lastmod is None or known.get(loc) != lastmod]
+
+    def refresh(loc):
+        # A changed lastmod means a fetch regardless of validators
+        changed = children[loc] is not None or loc not in known
+        fetched = fetch_child_sitemap(loc, {} if changed else store.child_validators(loc))
+        if fetched is None:
+            return False
+        entries, validators = fetched
+        store.replace_child(loc, children[loc], entries, validators)
+        return True
+
+    with ThreadPoolExecutor(max_workers=SITEMAP_WORKERS, thread_name_prefix="sitemap") as pool:
+        refetched = sum(pool.map(refresh, stale))
+    store.drop_children_except(set(children))
+    return refetched, len(children) - refetched
 
 def filter_urls(urls):
     collections = [u for u in urls if "/collections/" in u]
     products = [u for u in urls if "/products/" in u]
     return collections, products
 
-@st.cache_data(ttl=3600)
-def get_navigation_links():
-    sitemap_urls = fetch_sitemap('https://signaturelabels.co.uk/sitemap_collections_1.xml?from=459453825342&to=670428496251')
-    collections, products = filter_urls(sitemap_urls)
-    return collections, products
+def _slug_tokens(text):
+    return tuple(t for t in re.split(r"[^a-z0-9]+", text.lower()) if t)
 
+class LinkIndex:
+    """
+    Slug index over the store's collection and product URLs, built once per
+    navigation refresh. A name like "Luxury Pret" resolves to the URL whose
+    handle best matches its tokens: exact handle, then handles starting with
+    the name, then handles with the fewest extra tokens, then the shortest
+    URL - so the same name always resolves to the same link.
+    """
 
+    def __init__(self, collection_urls, product_urls):
+        self.collection_urls = list(collection_urls)
+        self.product_urls    = list(product_urls)
+        self._kinds = {
+            "collection": self._build(self.collection_urls),
+            "product":    self._build(self.product_urls),
+        }
+        self._memo = {}
+
+    @staticmethod
+    def _build(urls):
+        postings = {}
+        handles  = {}
+        for url in dict.fromkeys(urls):
+            handle = _slug_tokens(urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1])
+            if not handle:
+                continue
+            handles[url] = handle
+            for token in set(handle):
+                postings.setdefault(token, set()).add(url)
+        return {"postings": postings, "handles": handles, "tokens": sorted(postings)}
+
+    def _candidates(self, index, token):
+        urls = index["postings"].get(token)
+        if urls is not None:
+            return urls
+        # No exact token: fall back to tokens starting with it (binary search)
+        tokens = index["tokens"]
+        i = bisect.bisect_left(tokens, token)
+        found = set()
+        while i < len(tokens) and tokens[i].startswith(token):
+            found |= index["postings"][tokens[i]]
+            i += 1
+        return found
+
+    def resolve(self, name, kind="collection", default=DEFAULT_LINK):
+        """Best URL of `kind` ('collection' or 'product') for `name`, or `default`."""
+        query = _slug_tokens(name)
+        memo_key = (kind, query)
+        if memo_key in self._memo:
+            return self._memo[memo_key] or default
+        if not query:
+            return default
+
+        index = self._kinds[kind]
+        sets = sorted((self._candidates(index, t) for t in set(query)), key=len)
+        matches = set.intersection(*sets) if sets and sets[0] else set()
+
+        def rank(url):
+            handle = index["handles"][url]
+            return (handle != query, handle[:len(query)] != query, len(handle) - len(query), len(url), url)
+
+        best = min(matches, key=rank) if matches else None
+        self._memo[memo_key] = best
+        return best or default
 
+@st.cache_data(ttl=3600)
+def get_navigation_links():
+    """Collection / product URLs of the storefront, as a LinkIndex."""
+    store = get_sitemap_store()
+    try:
+        crawl_sitemap_index(SITEMAP_ROOT, store)
+    except Exception as exc:
+        # Fall back to whatever the last successful crawl stored
+        report("warning", f"Sitemap refresh failed: {exc}")
+    return LinkIndex(store.iter_urls("/collections/"), store.iter_urls("/products/"))
 
 
-from openai import OpenAI
-import streamlit as st
 
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
-def enhance_description_via_gpt(raw_description, product_title, vendor, product_type, categories, related_products, collection, collection_urls, product_urls):
 
-    shop_by_designer_link = next(
-        (u for u in collection_urls if vendor.lower() in u.lower()), '/collections/all'
-    )
+@shared_resource
+def get_openai_client():
+    return openai.OpenAI(api_key=get_secret("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL)
 
-    category_links = [
-        next((u for u in collection_urls if cat.lower().replace(' ', '-') in u.lower()), '/collections/all')
-        for cat in categories
-    ]
+def build_description_prompt(product_title, vendor, product_type, categories, related_products, collection, links):
 
-    related_product_links = [
-        next((u for u in product_urls if rp.lower().replace(' ', '-') in u.lower()), '/collections/all')
-        for rp in related_products
-    ]
+    shop_by_designer_link = links.resolve(vendor, "collection")
+    category_links        = [links.resolve(cat, "collection") for cat in categories]
+    related_product_links = [links.resolve(rp, "product") for rp in related_products]
 
     prompt = f"""
     You are a professional fashion content writer for "Signature Labels". Write a structured Shopify product description entirely in HTML format.
@@ -711,18 +2055,1475 @@ def enhance_description_via_gpt(raw_description, product_title, vendor, product_
     </section>
     """
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
+    return prompt
+
+@shared_resource
+def get_description_cache():
+    return DiskCache(os.path.join(CACHE_DIR, "descriptions.sqlite"),
+                     DESCRIPTION_CACHE_MAX_BYTES, ttl=DESCRIPTION_CACHE_TTL)
+
+def description_cache_key(prompt, params):
+    """Content address of a generation: the rendered prompt plus model and sampling parameters."""
+    blob = json.dumps({"prompt": prompt, **params}, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def generate_description(prompt, force=False):
+    """Run the prompt through GPT, reusing the cached output for an identical request."""
+    params = description_params()
+    cache = get_description_cache()
+    key = description_cache_key(prompt, params)
+    if not force:
+        hit = cache.get(key)
+        if hit:
+            report("info", "Description reused from cache")
+            count("llm_cache_hits")
+            return hit[0].decode("utf-8")
+
+    completion = get_openai_client().chat.completions.create(
         messages=[{"role": "user", "content": prompt}],
-        max_tokens=1500,
-        temperature=0.7,
+        **params
     )
+    if completion.usage:
+        count("llm_prompt_tokens", completion.usage.prompt_tokens)
+        count("llm_completion_tokens", completion.usage.completion_tokens)
 
     response_text = completion.choices[0].message.content.strip()
-
+    cache.put(key, response_text, {"model": params["model"]})
     return response_text
 
+def enhance_description_via_gpt(raw_description, product_title, vendor, product_type, categories, related_products, collection, links, force=False):
+    prompt = build_description_prompt(
+        product_title, vendor, product_type, categories, related_products, collection, links
+    )
+    return generate_description(prompt, force=force)
+
+
+
+# -----------------------------------
+# 6b2. PRE-FLIGHT HANDLE LOOKUP
+# -----------------------------------
+
+def lookup_products_by_handle(handles):
+    """
+    Store products for the given handles, PREFLIGHT_HANDLES_PER_QUERY per
+    `handle:a OR handle:b ...` search. Returns {handle: {id, title, variants}}
+    with each variant as {id, size, price, compareAtPrice, sku}. Products with
+    more than PREFLIGHT_VARIANTS_PAGE variants have the rest paged in.
+    """
+    variant_fields = """
+                  id
+                  price
+                  compareAtPrice
+                  sku
+                  selectedOptions { name value }
+    """
+    query = """
+    query($first: Int!, $after: String, $q: String!) {
+      products(first: $first, after: $after, query: $q) {
+        pageInfo { hasNextPage endCursor }
+        edges {
+          node {
+            id
+            handle
+            title
+            variants(first: %d) {
+              pageInfo { hasNextPage endCursor }
+              edges { node { %s } }
+            }
+          }
+        }
+      }
+    }
+    """ % (PREFLIGHT_VARIANTS_PAGE, variant_fields)
+    more_variants = """
+    query($first: Int!, $after: String, $id: ID!) {
+      product(id: $id) {
+        variants(first: $first, after: $after) {
+          pageInfo { hasNextPage endCursor }
+          edges { node { %s } }
+        }
+      }
+    }
+    """ % variant_fields
+    found = {}
+    handles = list(dict.fromkeys(handles))
+    for i in range(0, len(handles), PREFLIGHT_HANDLES_PER_QUERY):
+        chunk = handles[i:i + PREFLIGHT_HANDLES_PER_QUERY]
+        search = " OR ".join(f"handle:{h}" for h in chunk)
+        for edge in _paginate(query, ["products"], PREFLIGHT_HANDLES_PER_QUERY, {"q": search}):
+            node = edge["node"]
+            if node["handle"] not in chunk:
+                continue   # search matches are fuzzy; only exact handles count
+            variant_edges = node["variants"]["edges"]
+            page_info = node["variants"]["pageInfo"]
+            if page_info["hasNextPage"]:
+                variant_edges = itertools.chain(variant_edges, _paginate(
+                    more_variants, ["product", "variants"], PREFLIGHT_VARIANTS_PAGE,
+                    {"id": node["id"]}, after=page_info["endCursor"]
+                ))
+            variants = []
+            for ve in variant_edges:
+                v = ve["node"]
+                options = {o["name"]: o["value"] for o in v["selectedOptions"]}
+                variants.append({
+                    "id":             v["id"],
+                    "size":           options.get("Size") or next(iter(options.values()), "Default"),
+                    "price":          v["price"],
+                    "compareAtPrice": v["compareAtPrice"],
+                    "sku":            v["sku"],
+                })
+            found[node["handle"]] = {"id": node["id"], "title": node["title"], "variants": variants}
+    return found
+
+def _money(value):
+    return f"{float(value):.2f}" if value not in (None, "") else None
+
+def _variant_fingerprint(v):
+    return (v["size"], _money(v["price"]), _money(v["compareAtPrice"]), v.get("sku") or "")
+
+def classify_against_store(p_data, existing):
+    """'unchanged' when title and every variant's size/price/compare-at/SKU match the store, else 'changed'."""
+    if existing["title"] != p_data["title"]:
+        return "changed"
+    scraped = sorted(_variant_fingerprint(v) for v in p_data["variants"])
+    stored  = sorted(_variant_fingerprint(v) for v in existing["variants"])
+    return "unchanged" if scraped == stored else "changed"
+
+def iter_preflight(product_urls, existing):
+    """
+    Pass product URLs through while looking up, PREFLIGHT_CHUNK at a time,
+    which of their handles already exist in the store. Store products found
+    are added to `existing` ({url: store product}).
+    """
+    chunk = []
+
+    def resolve(urls):
+        try:
+            found = lookup_products_by_handle([product_handle(u) for u in urls])
+        except Exception as exc:
+            report("warning", f"Pre-flight lookup failed, treating products as new: {exc}")
+            found = {}
+        for u in urls:
+            if product_handle(u) in found:
+                existing[u] = found[product_handle(u)]
+        report("info", f"Pre-flight: {sum(1 for u in urls if u in existing)} of {len(urls)} already in the store")
+
+    for url in product_urls:
+        chunk.append(url)
+        if len(chunk) >= PREFLIGHT_CHUNK:
+            resolve(chunk)
+            yield from chunk
+            chunk = []
+    if chunk:
+        resolve(chunk)
+        yield from chunk
+
+# -----------------------------------
+# 6c. JOB LEDGER
+# -----------------------------------
+
+LEDGER_STAGES = ("scraped", "enhanced", "created", "metafields", "inventory", "media", "published", "collections")
+
+# Settings that change what a product's stages write; a job can only be
+# resumed with the settings it was started with
+LEDGER_FINGERPRINT_KEYS = ("product_type", "tags", "coll_ids", "del_id", "siz_id", "categories",
+                           "related_products", "collection", "write_mode", "force_regenerate", "preflight")
+
+def ledger_fingerprint(opts):
+    settings = {key: opts.get(key) for key in LEDGER_FINGERPRINT_KEYS}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+class LedgerStore:
+    """
+    SQLite store behind every JobLedger. Each run records its stages under a
+    job of its own; rows are only reused when that job is explicitly resumed,
+    and jobs untouched for LEDGER_TTL are dropped.
+    """
+
+    def __init__(self, path, ttl=LEDGER_TTL):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl   = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job TEXT PRIMARY KEY, owner TEXT, label TEXT, fingerprint TEXT, created REAL, updated REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_stages ("
+            " job TEXT, url TEXT, stage TEXT, data TEXT, updated REAL,"
+            " PRIMARY KEY (job, url, stage))"
+        )
+
+    def start(self, owner, label, opts):
+        """A new, empty ledger job for a run with these opts."""
+        self.prune()
+        job, now = os.urandom(4).hex(), time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job, owner, label, fingerprint, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (job, owner, label, ledger_fingerprint(opts), now, now)
+            )
+        return JobLedger(self, job)
+
+    def resume(self, job, opts):
+        """The ledger of an earlier job; raises ValueError if it's gone or its settings differ."""
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint FROM jobs WHERE job = ?", (job,)).fetchone()
+        if row is None:
+            raise ValueError(f"Ledger job {job} not found (expired or discarded)")
+        if row[0] != ledger_fingerprint(opts):
+            raise ValueError(f"Ledger job {job} was started with different settings; start a new job instead")
+        return JobLedger(self, job)
+
+    def jobs(self, owner=None):
+        """Recorded jobs, newest first: {job, owner, label, created, updated, stages}."""
+        self.prune()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job, owner, label, created, updated FROM jobs"
+                " WHERE ? IS NULL OR owner = ? ORDER BY created DESC", (owner, owner)
+            ).fetchall()
+        return [{"job": job, "owner": o, "label": label, "created": created, "updated": updated,
+                 "stages": JobLedger(self, job).summary()}
+                for job, o, label, created, updated in rows]
+
+    def delete(self, job):
+        with self._lock:
+            self._conn.execute("DELETE FROM job_stages WHERE job = ?", (job,))
+            self._conn.execute("DELETE FROM jobs WHERE job = ?", (job,))
+
+    def prune(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [r[0] for r in self._conn.execute("SELECT job FROM jobs WHERE updated < ?", (cutoff,))]
+        for job in expired:
+            self.delete(job)
+
+class JobLedger:
+    """
+    Durable per-URL record of which stages of a job's products finished,
+    with what each produced (scraped data, description, product and
+    inventory item IDs). Resuming the job skips every stage recorded here, so
+    a crash never causes a product to be created, or a description paid for, twice.
+    """
+
+    def __init__(self, store, job):
+        self.store = store
+        self.job   = job
+
+    def get(self, url, stage):
+        """The data recorded for a finished stage, or None if it hasn't finished."""
+        store = self.store
+        with store._lock:
+            row = store._conn.execute(
+                "SELECT data FROM job_stages WHERE job = ? AND url = ? AND stage = ?", (self.job, url, stage)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def done(self, url, stage, data=None):
+        store, now = self.store, time.time()
+        with store._lock:
+            store._conn.execute(
+                "INSERT OR REPLACE INTO job_stages (job, url, stage, data, updated) VALUES (?, ?, ?, ?, ?)",
+                (self.job, url, stage, json.dumps(data if data is not None else True), now)
+            )
+            store._conn.execute("UPDATE jobs SET updated = ? WHERE job = ?", (now, self.job))
+
+    def summary(self):
+        """{stage: number of URLs that finished it}."""
+        store = self.store
+        with store._lock:
+            counts = dict(store._conn.execute(
+                "SELECT stage, COUNT(*) FROM job_stages WHERE job = ? GROUP BY stage", (self.job,)
+            ))
+        return {stage: counts.get(stage, 0) for stage in LEDGER_STAGES}
+
+@shared_resource
+def get_ledger_store():
+    return LedgerStore(os.path.join(CACHE_DIR, "ledger.sqlite"))
+
+class _NoLedger:
+    """Stand-in for runs without a ledger: nothing is recorded or skipped."""
+
+    def get(self, url, stage):
+        return None
+
+    def done(self, url, stage, data=None):
+        pass
+
+def _ledger(opts):
+    return opts.get("ledger") or _NoLedger()
+
+# -----------------------------------
+# 7a. ASYNC DESCRIPTION STAGE
+# -----------------------------------
+
+def description_params():
+    return {
+        "model":       DESCRIPTION_MODEL,
+        "max_tokens":  DESCRIPTION_MAX_TOKENS,
+        "temperature": DESCRIPTION_TEMPERATURE,
+    }
+
+class AsyncRateLimiter:
+    """Requests-per-minute and tokens-per-minute budgets, refilled continuously."""
+
+    def __init__(self, rpm, tpm):
+        self.rpm, self.tpm = float(rpm), float(tpm)
+        self._requests, self._tokens = self.rpm, self.tpm
+        self._stamp = time.monotonic()
+        self._lock  = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed_min = (now - self._stamp) / 60
+        self._requests = min(self.rpm, self._requests + elapsed_min * self.rpm)
+        self._tokens   = min(self.tpm, self._tokens + elapsed_min * self.tpm)
+        self._stamp = now
+
+    async def acquire(self, tokens):
+        """Wait for one request slot and `tokens` tokens; returns the tokens reserved."""
+        tokens = min(tokens, self.tpm)
+        while True:
+            async with self._lock:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens   -= tokens
+                    return tokens
+                delay = max((1 - self._requests) * 60 / self.rpm,
+                            (tokens - self._tokens) * 60 / self.tpm)
+            await asyncio.sleep(max(delay, 0.01))
+
+    def refund(self, tokens):
+        """Return (or, if negative, charge) the difference to the actual usage."""
+        self._tokens = min(self.tpm, self._tokens + tokens)
+
+class AsyncEnricher:
+    """
+    Generates descriptions concurrently on a background asyncio loop with the
+    async OpenAI client, under `concurrency` in-flight calls and RPM / TPM
+    budgets, retrying rate-limit and transient errors with backoff.
+    submit() is thread-safe and returns a concurrent.futures.Future, so each
+    description can be handed to the upload stage the moment it is ready.
+    """
+
+    def __init__(self, concurrency=LLM_CONCURRENCY, rpm=LLM_RPM_LIMIT, tpm=LLM_TPM_LIMIT):
+        self._loop   = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-enricher", daemon=True)
+        self._thread.start()
+        self._client = openai.AsyncOpenAI(
+            api_key=get_secret("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL, max_retries=0
+        )
+        self._cache  = get_description_cache()
+
+        async def setup():
+            self._sem     = asyncio.Semaphore(concurrency)
+            self._limiter = AsyncRateLimiter(rpm, tpm)
+        asyncio.run_coroutine_threadsafe(setup(), self._loop).result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, prompt, force=False, scope=None):
+        """`scope` (see stage_scope) receives the call's latency and token counts."""
+        params = description_params()
+        key = description_cache_key(prompt, params)
+        hit = None if force else self._cache.get(key)
+        if hit:
+            count("llm_cache_hits", scope=scope)
+            future = Future()
+            future.set_result(hit[0].decode("utf-8"))
+            return future
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt, params, key, scope), self._loop)
+
+    async def _generate(self, prompt, params, key, scope=None):
+        started = time.monotonic()
+        # Rough prompt size (~4 chars/token) plus the completion budget
+        estimate = len(prompt) // 4 + params["max_tokens"]
+        async with self._sem:
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                reserved = await self._limiter.acquire(estimate)
+                try:
+                    completion = await self._client.chat.completions.create(
+                        messages=[{"role": "user", "content": prompt}],
+                        **params
+                    )
+                except (openai.RateLimitError, openai.APIConnectionError,
+                        openai.APITimeoutError, openai.InternalServerError):
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+                    backoff = min(60, 2 ** attempt)
+                    await asyncio.sleep(backoff / 2 + random.uniform(0, backoff / 2))
+                    continue
+
+                if completion.usage:
+                    self._limiter.refund(reserved - completion.usage.total_tokens)
+                    count("llm_prompt_tokens", completion.usage.prompt_tokens, scope)
+                    count("llm_completion_tokens", completion.usage.completion_tokens, scope)
+                observe(scope, time.monotonic() - started)
+                text = completion.choices[0].message.content.strip()
+                self._cache.put(key, text, {"model": params["model"]})
+                return text
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+# -----------------------------------
+# 7b. OFFLINE DESCRIPTION BATCHES
+# -----------------------------------
+
+class OpenAIBatchBackend:
+    """
+    Submission/polling layer for description batches, backed by the OpenAI
+    Batch API. Any object with the same three methods can be passed as
+    `batch_backend` instead, e.g. a local stand-in.
+    """
+
+    def __init__(self, openai_client=None):
+        self.client = openai_client or get_openai_client()
+
+    def submit(self, jsonl_path):
+        """Upload the request file and start the batch; returns the batch ID."""
+        with open(jsonl_path, "rb") as fh:
+            batch_file = self.client.files.create(file=fh, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        """One of: validating, in_progress, finalizing, completed, failed, expired, cancelling, cancelled."""
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id):
+        """Yield every output and error line of a finished batch as a dict."""
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+def write_description_batch(prompts, path):
+    """Write {custom_id: prompt} as Batch API chat-completion requests."""
+    params = description_params()
+    with open(path, "w", encoding="utf-8") as fh:
+        for custom_id, prompt in prompts.items():
+            fh.write(json.dumps({
+                "custom_id": custom_id,
+                "method":    "POST",
+                "url":       "/v1/chat/completions",
+                "body":      {"messages": [{"role": "user", "content": prompt}], **params},
+            }) + "\n")
+
+def run_description_batch(prompts, backend=None, poll_interval=None, timeout=None):
+    """
+    Generate {custom_id: prompt} as one batch job and wait for it.
+    Returns {custom_id: description} for the entries that succeeded; they
+    are also stored in the description cache. `poll_interval` / `timeout`
+    default to DESCRIPTION_BATCH_POLL_INTERVAL / DESCRIPTION_BATCH_TIMEOUT.
+    """
+    poll_interval = DESCRIPTION_BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+    timeout       = DESCRIPTION_BATCH_TIMEOUT if timeout is None else timeout
+    backend = backend or OpenAIBatchBackend()
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as fh:
+        path = fh.name
+    try:
+        write_description_batch(prompts, path)
+        batch_id = backend.submit(path)
+    finally:
+        os.remove(path)
+    report("info", f"Description batch submitted: {batch_id}")
+
+    deadline = time.monotonic() + timeout
+    last = None
+    while True:
+        status = backend.status(batch_id)
+        if status != last:
+            report("info", f"Description batch {batch_id}: {status}")
+            last = status
+        if status in ("completed", "failed", "expired", "cancelled"):
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Description batch {batch_id} still {status} after {timeout}s")
+        time.sleep(poll_interval)
+
+    cache, params = get_description_cache(), description_params()
+    texts = {}
+    for row in backend.results(batch_id):
+        custom_id = row.get("custom_id")
+        response  = row.get("response") or {}
+        if custom_id not in prompts or row.get("error") or response.get("status_code") != 200:
+            continue
+        text = response["body"]["choices"][0]["message"]["content"].strip()
+        texts[custom_id] = text
+        cache.put(description_cache_key(prompts[custom_id], params), text, {"model": params["model"]})
+    return texts
+
+# -----------------------------------
+# 7c. BATCH PIPELINE
+# -----------------------------------
+
+def scrape_stage(product_url, opts):
+    """
+    Scrape a product and assign the run's type and tags. A product scraped
+    (and described) by an earlier, interrupted run comes from the ledger.
+    """
+    ledger = _ledger(opts)
+    p_data = ledger.get(product_url, "scraped")
+    if p_data is None:
+        with measure(opts, product_url, "scrape"):
+            p_data = scrape_product(product_url)
+        ledger.done(product_url, "scraped", p_data)
+    else:
+        report("info", f"Resumed from ledger: {product_url}")
+
+    enhanced = None if opts.get("force_regenerate") else ledger.get(product_url, "enhanced")
+    if enhanced:
+        p_data["enhanced_description"] = enhanced["description"]
+
+    # Products the pre-flight found in the store skip description work:
+    # unchanged ones are skipped entirely, changed ones are updated in place.
+    # One this job already created is its own, so it resumes its stages instead
+    existing = (opts.get("existing") or {}).get(product_url)
+    if existing and not ledger.get(product_url, "created"):
+        p_data["preflight"] = classify_against_store(p_data, existing)
+        if p_data["preflight"] == "changed":
+            p_data["existing"] = existing
+        report("info", f"Already in store ({p_data['preflight']}): {existing['id']}")
+    else:
+        # Products uploaded as new get only checked, unique images
+        with measure(opts, product_url, "images"):
+            p_data["images"] = select_images(p_data["images"])
+
+    p_data["source_url"]  = product_url
+    p_data["productType"] = opts["product_type"]
+    p_data["tags"]        = opts["tags"]
+    return p_data
+
+def needs_description(p_data):
+    return "enhanced_description" not in p_data and "preflight" not in p_data
+
+def record_description(p_data, opts, description):
+    p_data["enhanced_description"] = description
+    _ledger(opts).done(p_data["source_url"], "enhanced", {"description": description})
+
+def description_prompt(p_data, opts):
+    return build_description_prompt(
+        product_title     = p_data["title"],
+        vendor            = p_data["vendor"],
+        product_type      = opts["product_type"],
+        categories        = opts["categories"],
+        related_products  = opts["related_products"],
+        collection        = opts["collection"],
+        links             = opts["links"]
+    )
+
+def prepare_product(product_url, opts):
+    """Scrape a product and fill in everything the upload needs."""
+    p_data = scrape_stage(product_url, opts)
+
+    # GPT-enhanced description
+    if needs_description(p_data):
+        with measure(opts, product_url, "describe"):
+            description = generate_description(
+                description_prompt(p_data, opts), force=opts.get("force_regenerate", False)
+            )
+        record_description(p_data, opts, description)
+    return p_data
+
+def upload_product(p_data, opts):
+    """
+    Create the product with its metafields, inventory and media. Returns its ID.
+    Each step is recorded in the ledger, and steps it already has are skipped.
+    """
+    ledger = _ledger(opts)
+    url = p_data.get("source_url")
+
+    created = ledger.get(url, "created")
+    if created:
+        product_id, inv_ids, complete = created["product_id"], created["inventory_item_ids"], created["complete"]
+        report("info", f"Product already created: {product_id}")
+    else:
+        # Create product & variants; in productSet mode this single call also
+        # writes category, metafields, inventory and media
+        product_id, inv_ids, complete = None, [], False
+        if opts.get("write_mode", "productSet") == "productSet" or p_data.get("existing"):
+            with measure(opts, url, "create"):
+                product_id, inv_ids = create_product_with_variants(p_data, opts)
+            if product_id:
+                complete = True
+                report("info", "Category, metafields, inventory and media set via productSet")
+            elif p_data.get("existing"):
+                return None
+            else:
+                report("warning", "Single-call productSet failed, retrying step by step")
+
+        if not product_id:
+            with measure(opts, url, "create"):
+                product_id, inv_ids = create_product_with_variants(p_data)
+            if not product_id:
+                return None
+        ledger.done(url, "created", {
+            "product_id": product_id, "inventory_item_ids": inv_ids, "complete": complete
+        })
+
+    if complete:
+        return product_id
+
+    # Metafields & inventory
+    if not ledger.get(url, "metafields"):
+        with measure(opts, url, "metafields"):
+            update_product_category(product_id)
+            update_faqs_metafield(product_id)
+            update_we_care_and_disclaimer(product_id)
+            update_delivery_and_size_chart_metafields(product_id, opts["del_id"], opts["siz_id"])
+        ledger.done(url, "metafields")
+
+    if not ledger.get(url, "inventory"):
+        # On the run-wide batcher the writes are deferred; run_batch marks the
+        # stage done once they're sent
+        shared = opts.get("inventory_batcher")
+        batcher = GraphQLBatcher() if shared is None else shared
+        with measure(opts, url, "inventory"):
+            keys = (enable_inventory_tracking(inv_ids, batcher) + activate_inventory(inv_ids, batcher)
+                    + set_inventory_quantity(inv_ids, batcher))
+            failed = batcher.flush() if shared is None else None
+        if shared is not None:
+            # run_batch holds this product's result until these ops are sent
+            opts["inventory_keys"][url] = keys
+        else:
+            _report_batch_errors("Inventory setup", failed)
+            if not failed:
+                ledger.done(url, "inventory")
+
+    if not ledger.get(url, "media"):
+        with measure(opts, url, "media"):
+            upload_media(product_id, p_data)
+        ledger.done(url, "media")
+    return product_id
+
+def finalize_product(product_id, opts, source_url=None):
+    """Publish & add to collections, or queue both on the run's DeferredFinalizer."""
+    if opts.get("finalizer"):
+        opts["finalizer"].queue(product_id, source_url)
+        return
+    ledger = _ledger(opts)
+    if not ledger.get(source_url, "published"):
+        publication_ids = opts.get("publication_ids")
+        if publication_ids is None:
+            publication_ids = get_publication_ids()
+        with measure(opts, source_url, "publish"):
+            publish_product(product_id, publication_ids)
+        ledger.done(source_url, "published")
+    if not ledger.get(source_url, "collections"):
+        with measure(opts, source_url, "collections"):
+            add_product_to_collections(product_id, opts["coll_ids"])
+        ledger.done(source_url, "collections")
+
+class DeferredFinalizer:
+    """
+    Publishes products and adds them to collections in bulk instead of one
+    call per product and collection: collectionAddProducts with up to
+    COLLECTION_ADD_CHUNK IDs per collection, and productPublish aliased
+    through a GraphQLBatcher. Flushed every `checkpoint` finished products
+    and at the end of the run. Results of queued products are held until
+    their flush, so a product whose publishing or membership failed is
+    still reported as failed.
+    """
+
+    def __init__(self, opts, checkpoint=DEFERRED_CHECKPOINT):
+        self.opts       = opts
+        self.checkpoint = checkpoint
+        self._queued    = {}   # source url -> product id
+        self._held      = {}   # source url -> result dict
+        self._lock      = threading.Lock()
+
+    def queue(self, product_id, source_url):
+        with self._lock:
+            self._queued[source_url] = product_id
+
+    def hold(self, result):
+        """Keep a queued product's result until its flush. False for products that aren't queued."""
+        with self._lock:
+            if result["url"] not in self._queued:
+                return False
+            if result["status"] == "failed":
+                del self._queued[result["url"]]
+                return False
+            self._held[result["url"]] = result
+            return True
+
+    def due(self):
+        return len(self._held) >= self.checkpoint
+
+    def flush(self):
+        """Publish and add every held product; returns their results."""
+        with self._lock:
+            held, self._held = self._held, {}
+            batch = {url: self._queued.pop(url) for url in held}
+        if not batch:
+            return []
+
+        opts, ledger, failed = self.opts, _ledger(self.opts), {}
+        publication_ids = opts.get("publication_ids")
+        if publication_ids is None:
+            publication_ids = get_publication_ids()
+
+        with measure(opts, None, "publish_batch"):
+            batcher = GraphQLBatcher()
+            batcher.add_many([
+                (url, "productPublish", {"input": ("ProductPublishInput!", {
+                    "id": pid, "productPublications": [{"publicationId": p} for p in publication_ids]
+                })})
+                for url, pid in batch.items() if not ledger.get(url, "published")
+            ])
+            for url, errors in batcher.flush().items():
+                failed[url] = f"Publish errors: {errors}"
+
+        with measure(opts, None, "collections_batch"):
+            pending = [(url, pid) for url, pid in batch.items() if not ledger.get(url, "collections")]
+            for cid in opts["coll_ids"]:
+                for i in range(0, len(pending), COLLECTION_ADD_CHUNK):
+                    chunk = pending[i:i + COLLECTION_ADD_CHUNK]
+                    if not add_products_to_collection(cid, [pid for _url, pid in chunk]):
+                        continue
+                    # The chunk failed as a whole: retry one by one to find the products at fault
+                    for url, pid in chunk:
+                        errors = add_products_to_collection(cid, [pid])
+                        if errors:
+                            failed[url] = f"Collection {cid} errors: {errors}"
+
+        for url, result in held.items():
+            if url in failed:
+                result["status"], result["error"] = "failed", failed[url]
+                result["messages"].append(("error", failed[url]))
+            else:
+                ledger.done(url, "published")
+                ledger.done(url, "collections")
+        report("info", f"Published and added {len(batch) - len(failed)} products to collections")
+        return list(held.values())
+
+def process_one(product_url, opts):
+    """
+    Scrape, enhance and upload a single product.
+    `opts` holds the run-wide selections made in the UI.
+    Returns the product dict (see upload_and_finalize), or None if it failed.
+    """
+    p_data = prepare_product(product_url, opts)
+    return upload_and_finalize(p_data, opts)
 
+def upload_and_finalize(p_data, opts):
+    """
+    Upload a prepared product, then publish it. Returns the product dict with
+    its `outcome` ('uploaded', 'updated' or 'unchanged'), or None on failure.
+    """
+    if p_data.get("preflight") == "unchanged":
+        report("info", f"Unchanged, skipped: {p_data['title']}")
+        p_data["outcome"] = "unchanged"
+        return p_data
+
+    product_id = upload_product(p_data, opts)
+    if not product_id:
+        return None
+    finalize_product(product_id, opts, p_data.get("source_url"))
+
+    p_data["outcome"] = "updated" if p_data.get("existing") else "uploaded"
+    report("success", f"{p_data['outcome'].capitalize()}: {p_data['title']}")
+    return p_data
+
+def _captured(task, *args):
+    """
+    Run task(*args) on the current worker, capturing its messages and any
+    failure. Returns (value, error, messages, seconds).
+    """
+    messages = []
+    _report_local.sink = messages
+    started = time.monotonic()
+    value, error = None, None
+    try:
+        value = task(*args)
+        if not value:
+            errors = [m for level, m in messages if level == "error"]
+            error = errors[-1] if errors else "Product was not created"
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    finally:
+        _report_local.sink = None
+    return value, error, messages, round(time.monotonic() - started, 2)
+
+def _batch_result(product_url, outcome, error, messages, seconds):
+    """One row of the results table; `outcome` is the finished product dict or its title."""
+    if isinstance(outcome, dict):
+        title, status = outcome["title"], outcome.get("outcome", "uploaded")
+    else:
+        title, status = outcome, "uploaded"
+    return {
+        "url":      product_url,
+        "status":   status if title and not error else "failed",
+        "title":    title,
+        "error":    error,
+        "seconds":  seconds,
+        "messages": messages,
+    }
+
+def _process_isolated(product_url, opts):
+    """Run process_one in a worker; one result dict per product."""
+    title, error, messages, seconds = _captured(process_one, product_url, opts)
+    return _batch_result(product_url, title, error, messages, seconds)
+
+def _pool_run(items, task, workers, on_done):
+    """
+    Run task(item) for every item on `workers` threads, calling on_done(item, value)
+    on the calling thread as each finishes. At most 2x `workers` items are in
+    flight, so `items` may be a long-running generator.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as pool:
+        pending = {}
+        for item in items:
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    on_done(pending.pop(f), f.result())
+            pending[pool.submit(task, item)] = item
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                on_done(pending.pop(f), f.result())
+
+def canonical_url(url):
+    """
+    One spelling per page: no query string (variant), fragment or trailing
+    slash, a lower-case host, and collection-scoped product URLs
+    (/collections/x/products/y) reduced to /products/y.
+    """
+    url = url.strip()
+    parts = urlsplit(url if "://" in url else "https://" + url)
+    path = parts.path.rstrip("/")
+    if "/products/" in path:
+        path = "/products/" + path.split("/products/", 1)[1].split("/")[0]
+    return f"{parts.scheme}://{parts.netloc.lower()}{path}"
+
+def iter_url_file(fh, name=""):
+    """
+    URLs from a binary file object, one per line (first column for .csv),
+    gzip-compressed or not. Read lazily, so memory stays flat however long
+    the file is. Blank, comment and header lines are skipped.
+    """
+    if hasattr(fh, "peek"):
+        magic = fh.peek(2)[:2]
+    else:
+        magic = fh.read(2)
+        fh.seek(0)
+    raw  = gzip.GzipFile(fileobj=fh) if magic == b"\x1f\x8b" else fh
+    text = io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="")
+    try:
+        is_csv = name.lower().removesuffix(".gz").endswith(".csv")
+        for row in (csv.reader(text) if is_csv else ([line] for line in text)):
+            url = row[0].strip() if row else ""
+            if ("/" in url or "." in url) and not url.startswith("#"):
+                yield url
+    finally:
+        text.detach()   # leave the caller's file open
+
+class SeenUrls:
+    """
+    Canonical URLs already handled in a job, kept as 8-byte digests so a
+    100k-URL job holds a few MB rather than every string.
+    """
+
+    def __init__(self):
+        self._digests = set()
+        self._lock    = threading.Lock()
+
+    def add(self, url):
+        """True the first time `url` is added."""
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+        with self._lock:
+            if digest in self._digests:
+                return False
+            self._digests.add(digest)
+            return True
+
+def iter_product_urls(urls, seen=None):
+    """
+    Expand collection URLs into their product URLs, lazily. Every URL is
+    canonicalised and yielded once per job (`seen`), whether it was listed
+    directly or found in a collection.
+    """
+    seen = seen if seen is not None else SeenUrls()
+    for u in urls:
+        u = canonical_url(u)
+        if not seen.add(u):
+            continue
+        if "/products/" in u:
+            yield u
+        else:
+            report("info", f"Collection Mode: {u}")
+            try:
+                for product_url in scrape_collection(u):
+                    product_url = canonical_url(product_url)
+                    if seen.add(product_url):
+                        yield product_url
+            except Exception as exc:
+                report("error", f"Could not scrape collection {u}: {exc}")
+
+def run_options(product_type, tags=None, coll_ids=None, del_id=None, siz_id=None, categories=None,
+                related_products=None, collection="", links=None, write_mode="productSet",
+                publication_ids=None, force_regenerate=False, llm_mode="inline", llm_limits=None,
+                preflight=False, defer_finalize=False, **extra):
+    """
+    The opts dict run_batch reads, as main_app, cli.py and the benchmarks
+    build it. Without `links` descriptions get no internal links; without
+    `publication_ids` each run looks them up. `extra` (metrics, ledger) is
+    passed through.
+    """
+    return {
+        "product_type":     product_type,
+        "tags":             list(tags or []),
+        "coll_ids":         list(coll_ids or []),
+        "del_id":           del_id,
+        "siz_id":           siz_id,
+        "categories":       list(categories or []),
+        "related_products": list(related_products or []),
+        "collection":       collection,
+        "links":            links if links is not None else LinkIndex([], []),
+        "write_mode":       write_mode,
+        "publication_ids":  publication_ids,
+        "force_regenerate": force_regenerate,
+        "llm_mode":         llm_mode,
+        "llm_limits":       llm_limits or (LLM_CONCURRENCY, LLM_RPM_LIMIT, LLM_TPM_LIMIT),
+        "preflight":        preflight,
+        "defer_finalize":   defer_finalize,
+        **extra,
+    }
+
+def run_batch(product_urls, opts, workers=DEFAULT_WORKERS, on_result=None):
+    """
+    Process product URLs on a pool of `workers` threads.
+    A failing product never stops the batch; every product yields one result
+    dict, passed to `on_result` (on the calling thread) as soon as it's done.
+    """
+    if opts.get("preflight"):
+        opts = {**opts, "existing": {}}
+        product_urls = iter_preflight(product_urls, opts["existing"])
+
+    # Deferred mode: results of created products are held back until the
+    # finalizer has published them and added them to their collections
+    deliver = on_result or (lambda result: None)
+    if opts.get("defer_finalize"):
+        finalizer = DeferredFinalizer(opts)
+        opts = {**opts, "finalizer": finalizer}
+
+        def on_result(result):
+            if not finalizer.hold(result):
+                deliver(result)
+            elif finalizer.due():
+                for held in finalizer.flush():
+                    deliver(held)
+
+    if opts.get("write_mode") == "bulk":
+        results = run_bulk_batch(product_urls, opts, workers=workers, on_result=on_result)
+    else:
+        # Step-by-step inventory setup for the whole run shares one batcher, so a
+        # collection's variants are tracked/activated/stocked in a few requests.
+        # A product's result is held until its ops are sent, so their errors
+        # are reported against it.
+        batcher = GraphQLBatcher(auto_flush=True)
+        inventory_keys = {}   # product url -> keys of its ops on the shared batcher
+        opts = {**opts, "inventory_batcher": batcher, "inventory_keys": inventory_keys}
+        results, held = [], []
+
+        def release(pending):
+            waiting = []
+            for result in held:
+                keys = inventory_keys.get(result["url"], ())
+                if any(key in pending for key in keys):
+                    waiting.append(result)
+                    continue
+                errors = [batcher.errors[key] for key in keys if key in batcher.errors]
+                if errors and result["status"] != "failed":
+                    result["status"], result["error"] = "failed", f"Inventory setup errors: {errors}"
+                    result["messages"].append(("error", result["error"]))
+                elif keys and not errors:
+                    _ledger(opts).done(result["url"], "inventory")
+                if on_result:
+                    on_result(result)
+            held[:] = waiting
+
+        def collect(result):
+            results.append(result)
+            held.append(result)
+            release(batcher.pending_keys())
+
+        if opts.get("llm_mode") == "async":
+            _run_async_llm(product_urls, opts, workers, collect)
+        elif opts.get("llm_mode") == "batch":
+            _run_batch_llm(product_urls, opts, workers, collect)
+        else:
+            _pool_run(product_urls, lambda u: _process_isolated(u, opts), workers, lambda _u, r: collect(r))
+
+        batcher.flush()
+        release(set())
+
+    if opts.get("finalizer"):
+        for held in opts["finalizer"].flush():
+            deliver(held)
+    return results
+
+def _run_async_llm(product_urls, opts, workers, emit):
+    """
+    Async description mode: products are scraped on the worker pool, their
+    descriptions generated concurrently by an AsyncEnricher, and each one is
+    uploaded as soon as its description arrives - there is no barrier
+    between the stages. Scraping pauses while too many products are waiting
+    on the later stages, so memory stays bounded for long inputs.
+    """
+    concurrency, rpm, tpm = opts.get("llm_limits", (LLM_CONCURRENCY, LLM_RPM_LIMIT, LLM_TPM_LIMIT))
+    force = opts.get("force_regenerate", False)
+    finished = queue.Queue()
+    outstanding = 0
+    max_outstanding = workers * 2 + concurrency
+
+    def drain(limit):
+        nonlocal outstanding
+        while outstanding > limit or not finished.empty():
+            emit(finished.get())
+            outstanding -= 1
+
+    def upload_stage(url, p_data, description, messages, seconds):
+        def task():
+            if needs_description(p_data):
+                record_description(p_data, opts, description.result())
+            return upload_and_finalize(p_data, opts)
+
+        title, error, more_messages, more_seconds = _captured(task)
+        finished.put(_batch_result(url, title, error, messages + more_messages, seconds + more_seconds))
+
+    with AsyncEnricher(concurrency, rpm, tpm) as enricher, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as uploads:
+
+        def on_scraped(url, captured):
+            nonlocal outstanding
+            p_data, error, messages, seconds = captured
+            if error:
+                emit(_batch_result(url, None, error, messages, seconds))
+                return
+            outstanding += 1
+            if not needs_description(p_data):
+                description = Future()
+                description.set_result(p_data.get("enhanced_description"))
+            else:
+                description = enricher.submit(
+                    description_prompt(p_data, opts), force, stage_scope(opts, url, "describe")
+                )
+            description.add_done_callback(
+                lambda f: uploads.submit(upload_stage, url, p_data, f, messages, seconds)
+            )
+            drain(max_outstanding)
+
+        _pool_run(product_urls, lambda u: _captured(scrape_stage, u, opts), workers, on_scraped)
+        drain(0)
+
+def _run_batch_llm(product_urls, opts, workers, emit):
+    """
+    Offline batch mode: scrape everything, generate all missing descriptions
+    as one batch job, then upload. Products whose batch entry failed fall back
+    to a synchronous call during their upload.
+    """
+    force = opts.get("force_regenerate", False)
+    prepared = []   # (url, p_data, prompt, messages, seconds)
+
+    def on_scraped(url, captured):
+        p_data, error, messages, seconds = captured
+        if error:
+            emit(_batch_result(url, None, error, messages, seconds))
+            return
+        prepared.append((url, p_data, description_prompt(p_data, opts), messages, seconds))
+
+    _pool_run(product_urls, lambda u: _captured(scrape_stage, u, opts), workers, on_scraped)
+
+    # Cached descriptions don't need to go through the batch at all
+    cache, params = get_description_cache(), description_params()
+    pending = {}
+    for n, (_url, p_data, prompt, _messages, _seconds) in enumerate(prepared):
+        if not needs_description(p_data):
+            continue
+        hit = None if force else cache.get(description_cache_key(prompt, params))
+        if hit:
+            record_description(p_data, opts, hit[0].decode("utf-8"))
+        else:
+            pending[f"product-{n}"] = prompt
+
+    if pending:
+        report("info", f"Submitting a batch of {len(pending)} descriptions")
+        try:
+            with measure(opts, None, "describe_batch"):
+                texts = run_description_batch(pending, backend=opts.get("batch_backend"))
+        except Exception as exc:
+            report("warning", f"Description batch failed ({exc}); generating synchronously")
+            texts = {}
+        for custom_id, text in texts.items():
+            record_description(prepared[int(custom_id.rsplit("-", 1)[1])][1], opts, text)
+
+    def upload(n):
+        url, p_data, prompt, _messages, _seconds = prepared[n]
+        if needs_description(p_data):
+            report("warning", "No batch result for this product, generating synchronously")
+            with measure(opts, url, "describe"):
+                description = generate_description(prompt, force=force)
+            record_description(p_data, opts, description)
+        return upload_and_finalize(p_data, opts)
+
+    def on_uploaded(n, captured):
+        url, _p_data, _prompt, messages, seconds = prepared[n]
+        title, error, more_messages, more_seconds = captured
+        emit(_batch_result(url, title, error, messages + more_messages, seconds + more_seconds))
+
+    _pool_run(range(len(prepared)), lambda n: _captured(upload, n), workers, on_uploaded)
+
+def run_bulk_batch(product_urls, opts, workers=DEFAULT_WORKERS, on_result=None):
+    """
+    Bulk mode: prepare every product concurrently, create them all with one
+    bulk productSet operation, then publish / add to collections per product.
+    """
+    results = []
+
+    def emit(result):
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    # Phase 1: scrape + enhance, streaming each ProductSetInput to the JSONL file.
+    # Products the ledger already has as created skip the bulk operation.
+    ledger = _ledger(opts)
+    prepared = []   # (url, product dict, messages, seconds) in JSONL line order
+    resumed  = []   # (url, title, messages, seconds, product_id)
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as fh:
+        jsonl_path = fh.name
+
+        def on_prepared(url, captured):
+            p_data, error, messages, seconds = captured
+            if error:
+                emit(_batch_result(url, None, error, messages, seconds))
+                return
+            # The ledger comes first: a product this job created before it was
+            # interrupted looks unchanged to the pre-flight but isn't finalized yet
+            created = ledger.get(url, "created")
+            if created:
+                resumed.append((url, p_data["title"], messages, seconds, created["product_id"]))
+                return
+            if p_data.get("preflight") == "unchanged":
+                p_data["outcome"] = "unchanged"
+                emit(_batch_result(url, p_data, None, messages, seconds))
+                return
+            p_data["outcome"] = "updated" if p_data.get("existing") else "uploaded"
+            product_input = build_product_set_input(p_data, opts)
+            fh.write(json.dumps({"input": product_input}) + "\n")
+            prepared.append((url, p_data, messages, seconds))
+
+        _pool_run(product_urls, lambda u: _captured(prepare_product, u, opts), workers, on_prepared)
+
+    # Phase 2: one bulk operation for all products
+    created = {}
+    try:
+        if prepared:
+            report("info", f"Submitting bulk productSet for {len(prepared)} products")
+            try:
+                with measure(opts, None, "bulk_create"):
+                    created = bulk_product_set(jsonl_path)
+            except Exception as exc:
+                for url, title, messages, seconds in prepared:
+                    emit(_batch_result(url, title, f"Bulk operation failed: {exc}", messages, seconds))
+                prepared = []
+    finally:
+        os.remove(jsonl_path)
+
+    to_finalize = list(resumed)
+    for line, (url, title, messages, seconds) in enumerate(prepared):
+        product_id, inv_ids, errors = created.get(line, (None, [], ["No result line for product"]))
+        if errors or not product_id:
+            emit(_batch_result(url, title, f"Create product errors: {errors}", messages, seconds))
+            continue
+        ledger.done(url, "created", {"product_id": product_id, "inventory_item_ids": inv_ids, "complete": True})
+        to_finalize.append((url, title, messages, seconds, product_id))
+
+    # Phase 3: follow-up steps per created product
+    def finalize(n):
+        url, _title, _messages, _seconds, product_id = to_finalize[n]
+        finalize_product(product_id, opts, url)
+        return product_id
+
+    def on_finalized(n, captured):
+        url, title, messages, seconds, _product_id = to_finalize[n]
+        _product_id, error, more_messages, more_seconds = captured
+        emit(_batch_result(url, title, error, messages + more_messages, seconds + more_seconds))
+
+    _pool_run(range(len(to_finalize)), lambda n: _captured(finalize, n), workers, on_finalized)
+    return results
+
+def show_batch_results(results):
+    """Summary table plus the captured messages of every failed product."""
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    failed = [r for r in results if r["status"] == "failed"]
+    st.write("**" + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())) + "**")
+    st.dataframe(
+        [{k: r[k] for k in ("status", "title", "url", "seconds", "error")} for r in results],
+        use_container_width=True
+    )
+    for r in failed:
+        with st.expander(f"❌ {r['url']}"):
+            for level, message in r["messages"]:
+                st.write(f"{level.upper()}: {message}")
+
+# -----------------------------------
+# 7d. PRICE RE-SYNC
+# -----------------------------------
+# Reflects source price changes without a full re-import: only the .js
+# variant data is fetched, and only variants whose price or compare-at price
+# differ are written, one productVariantsBulkUpdate per product, aliased
+# across products by a GraphQLBatcher.
+
+def variant_price_changes(variants, existing):
+    """{id, price, compareAtPrice} for every store variant whose scraped prices differ."""
+    by_size = {ev["size"]: ev for ev in existing["variants"]}
+    changes = []
+    for v in variants:
+        ev = by_size.get(v["size"])
+        if not ev:
+            continue
+        if (_money(v["price"]), _money(v["compareAtPrice"])) != (_money(ev["price"]), _money(ev["compareAtPrice"])):
+            changes.append({"id": ev["id"], "price": v["price"], "compareAtPrice": v["compareAtPrice"]})
+    return changes
+
+def resync_one(product_url, existing):
+    """Re-fetch a product's .js variants and diff them against the store."""
+    # Always revalidated: a copy cached by an earlier scrape may predate the price change
+    js, _changed = fetch_product_js(product_url, max_age=0)
+    changes = variant_price_changes(variant_rows(js.get("variants", [])), existing)
+    if changes:
+        report("info", f"{len(changes)} variant price(s) changed")
+    return {"title": existing["title"], "product_id": existing["id"], "changes": changes}
+
+def resync_prices(product_urls, workers=DEFAULT_WORKERS, on_result=None, metrics=None):
+    """
+    Price re-sync for products already in the store. URLs whose handle isn't
+    in the store are reported as 'not in store'; the rest end up 'repriced',
+    'unchanged' or 'failed'.
+    """
+    opts     = {"metrics": metrics}
+    existing = {}
+    batcher  = GraphQLBatcher()
+    queued   = []   # results waiting for their productVariantsBulkUpdate
+    results  = []
+
+    def emit(result):
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    def send_queued():
+        with measure(opts, None, "variant_update"):
+            failed = batcher.flush()
+        for result in queued:
+            if result["url"] in failed:
+                result["status"] = "failed"
+                result["error"]  = f"Variant update errors: {failed[result['url']]}"
+            emit(result)
+        queued.clear()
+
+    def task(url):
+        if url not in existing:
+            return None
+        with measure(opts, url, "resync"):
+            return _captured(resync_one, url, existing[url])
+
+    def on_done(url, captured):
+        if captured is None:
+            result = _batch_result(url, None, None, [], 0)
+            result["status"] = "not in store"
+            emit(result)
+            return
+        synced, error, messages, seconds = captured
+        result = _batch_result(url, synced and synced["title"], error, messages, seconds)
+        if error or not synced["changes"]:
+            if not error:
+                result["status"] = "unchanged"
+            emit(result)
+            return
+        result["status"] = "repriced"
+        batcher.add(url, "productVariantsBulkUpdate", {
+            "productId": ("ID!", synced["product_id"]),
+            "variants":  ("[ProductVariantsBulkInput!]!", synced["changes"]),
+        })
+        queued.append(result)
+        if len(batcher) >= batcher.chunk_size:
+            send_queued()
+
+    _pool_run(iter_preflight(product_urls, existing), task, workers, on_done)
+    send_queued()
+    return results
+
+# -----------------------------------
+# 7e. BACKGROUND JOBS
+# -----------------------------------
+# A run is submitted as a job to a process-wide runner, so reruns, widget
+# interaction or a closed browser tab don't interrupt it and the page stays
+# responsive. The UI only reads job state. Every operator's jobs share the
+# runner's queue; JOB_RUNNER_SLOTS of them run at once.
+
+class JobRunner:
+    def __init__(self, slots=JOB_RUNNER_SLOTS):
+        self._pool = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="job")
+        self._ids  = itertools.count(1)
+        self._lock = threading.Lock()
+        self.jobs  = {}   # job id -> job dict, in submission order
+
+    def submit(self, owner, label, urls, opts, workers, resync=False):
+        """Queue a run; returns its job id."""
+        job = {
+            "id":        next(self._ids),
+            "owner":     owner,
+            "label":     label,
+            "status":    "queued",
+            "read":      0,      # product URLs read from the input so far
+            "total":     None,   # known once the input is exhausted
+            "results":   [],
+            "messages":  [],     # job-level messages (collection expansion etc.)
+            "error":     None,
+            "metrics":   Metrics(),
+            "submitted": time.time(),
+            "started":   None,
+            "finished":  None,
+            "cancel":    threading.Event(),
+        }
+        with self._lock:
+            self.jobs[job["id"]] = job
+            self._prune()
+        self._pool.submit(self._run, job, urls, opts, workers, resync)
+        return job["id"]
+
+    def cancel(self, job_id):
+        """Stop feeding new products to a job; products in flight still finish."""
+        self.jobs[job_id]["cancel"].set()
+
+    def recent(self):
+        """Jobs newest first."""
+        with self._lock:
+            return list(reversed(self.jobs.values()))
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j["finished"]]
+        for job in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self.jobs[job["id"]]
+
+    def _run(self, job, urls, opts, workers, resync):
+        if job["cancel"].is_set():
+            job["status"], job["finished"] = "cancelled", time.time()
+            return
+        job["status"], job["started"] = "running", time.time()
+        _report_local.sink = job["messages"]
+        try:
+            # The input is streamed, so the total is only known at its end
+            def feed():
+                for url in iter_product_urls(urls):
+                    if job["cancel"].is_set():
+                        return
+                    job["read"] += 1
+                    yield url
+                job["total"] = job["read"]
+
+            def on_result(result):
+                job["metrics"].finish(result)
+                job["results"].append(result)
+
+            if resync:
+                resync_prices(feed(), workers=workers, on_result=on_result, metrics=job["metrics"])
+            else:
+                run_batch(feed(), {**opts, "metrics": job["metrics"]}, workers=workers, on_result=on_result)
+            job["status"] = "cancelled" if job["cancel"].is_set() else "done"
+        except Exception as exc:
+            job["status"], job["error"] = "failed", f"{type(exc).__name__}: {exc}"
+        finally:
+            _report_local.sink = None
+            job["finished"] = time.time()
+
+@shared_resource
+def get_job_runner():
+    return JobRunner()
+
+def show_job(job, runner):
+    done, total = len(job["results"]), job["total"]
+    failed = sum(1 for r in job["results"] if r["status"] == "failed")
+    elapsed_min = max((job["finished"] or time.time()) - (job["started"] or time.time()), 1e-6) / 60
+    icon = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "❌", "cancelled": "⏹"}[job["status"]]
+    with st.container(border=True):
+        st.markdown(f"**{icon} #{job['id']} {job['label']}** · {job['owner']} · {job['status']}")
+        rate = f"{failed} failed · {done / elapsed_min:.1f} products/min"
+        if total is not None:
+            st.progress(done / max(total, 1), text=f"{done} / {total} products · {rate}")
+        elif job["started"]:
+            st.caption(f"{done} done, {job['read']} read so far · {rate}")
+        if job["error"]:
+            st.error(job["error"])
+        for level, message in job["messages"]:
+            if level in ("warning", "error"):
+                st.write(f"{level.upper()}: {message}")
+        if job["status"] in ("queued", "running"):
+            if st.button("Cancel", key=f"cancel_job_{job['id']}", disabled=job["cancel"].is_set()):
+                runner.cancel(job["id"])
+        elif job["results"]:
+            show_batch_results(list(job["results"]))
+        if job["started"]:
+            show_metrics(job["metrics"], key=f"job_{job['id']}")
+
+def show_metrics(metrics, key):
+    """Per-stage latency and cost table, with JSON / Prometheus downloads."""
+    summary = metrics.summary()
+    with st.expander(f"📊 Metrics · {summary['products_per_minute']} products/min"):
+        st.dataframe(
+            [{"stage": stage, **values} for stage, values in sorted(summary["stages"].items())],
+            use_container_width=True
+        )
+        json_col, prom_col = st.columns(2)
+        json_col.download_button("Export JSON", metrics.to_json(), file_name=f"{key}_metrics.json",
+                                 mime="application/json", key=f"{key}_metrics_json")
+        prom_col.download_button("Export Prometheus", metrics.to_prometheus(), file_name=f"{key}_metrics.prom",
+                                 mime="text/plain", key=f"{key}_metrics_prom")
+
+def _poll_every(seconds):
+    """Re-run the decorated panel on a timer where Streamlit supports fragments."""
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragment is None:
+        return lambda fn: fn
+    return fragment(run_every=seconds)
+
+@_poll_every(JOB_POLL_INTERVAL)
+def show_jobs():
+    """Status of every queued, running and recent job; refreshed without blocking the page."""
+    runner = get_job_runner()
+    jobs = runner.recent()
+    if not jobs:
+        return
+    st.subheader("Jobs")
+    if not st.checkbox("Show every operator's jobs", value=True, key="show_all_jobs"):
+        jobs = [j for j in jobs if j["owner"] == st.session_state.get("username")]
+    for job in jobs:
+        show_job(job, runner)
 
 def main_app():
     st.title("🚀 Shopify Uploader")
@@ -741,8 +3542,8 @@ def main_app():
     # NEW: File uploader for batch URLs
     # -----------------------------------
     uploaded_file = st.file_uploader(
-        "Upload a file (txt or csv) with one URL per line",
-        type=["txt", "csv"]
+        "Upload a file (txt or csv, optionally .gz) with one URL per line",
+        type=["txt", "csv", "gz"]
     )
 
     # Only show manual URL input if no file provided
@@ -750,19 +3551,17 @@ def main_app():
         url = st.text_input("Enter Product or Collection URL:")
         urls_to_process = [url.strip()] if url else []
     else:
-        if uploaded_file.name.lower().endswith(".csv"):
-            import pandas as pd
-            df = pd.read_csv(uploaded_file, header=None)
-            urls_to_process = df.iloc[:, 0].dropna().astype(str).str.strip().tolist()
-        else:
-            content = uploaded_file.read().decode("utf-8")
-            urls_to_process = [
-                line.strip() for line in content.splitlines() if line.strip()
-            ]
+        # Parsed lazily by the job, not on every rerun
+        urls_to_process = iter_url_file(uploaded_file, uploaded_file.name)
 
     # -----------------------------------
-    # Fetch Shopify collections, tags and pages
+    # Fetch Shopify collections, tags and pages (cached)
     # -----------------------------------
+    refresh_col, cache_col = st.columns(2)
+    if refresh_col.button("🔄 Refresh store data"):
+        clear_store_metadata_cache()
+    if cache_col.button("🧹 Clear scrape cache"):
+        get_scrape_cache().clear()
     collections, tags = fetch_collections_and_tags()
     delivery_pages, size_pages = fetch_and_filter_pages()
 
@@ -786,83 +3585,128 @@ def main_app():
     )
     collection = st.text_input("Collection Name:", "Eid Collection")
 
+    workers = st.slider("Concurrent workers:", 1, MAX_WORKERS, DEFAULT_WORKERS)
+    WRITE_MODES = {
+        "Single productSet call": "productSet",
+        "Step by step (one call per field)": "steps",
+        "Bulk operation (large batches)":    "bulk",
+    }
+    write_mode = st.radio("Write mode:", list(WRITE_MODES.keys()), horizontal=True)
+    resync_only = st.checkbox(
+        "Price re-sync only",
+        help="Only re-fetch variant prices and update those that changed on products "
+             "already in the store. No scraping of descriptions, media or publishing."
+    )
+    LLM_MODES = {
+        "Inline (one call per worker)":           "inline",
+        "Async stage (concurrent, rate-limited)": "async",
+        "Offline batch job (overnight imports)":  "batch",
+    }
+    llm_mode = st.radio("Description generation:", list(LLM_MODES.keys()), horizontal=True)
+    with st.expander("LLM limits"):
+        llm_concurrency = st.number_input("Concurrent requests", 1, 256, LLM_CONCURRENCY)
+        llm_rpm = st.number_input("Requests per minute", 1, 100_000, LLM_RPM_LIMIT)
+        llm_tpm = st.number_input("Tokens per minute", 1_000, 100_000_000, LLM_TPM_LIMIT)
+    defer_finalize = st.checkbox(
+        "Batch publishing and collection adds",
+        value=True,
+        help=f"Publish and add products to collections in bulk every {DEFERRED_CHECKPOINT} products "
+             "instead of one call per product and collection."
+    )
+    preflight = st.checkbox(
+        "Pre-flight: skip unchanged products, update changed ones",
+        value=True,
+        help="Look up every handle in the store first. Unchanged products are skipped; "
+             "changed ones are updated in place without a new description."
+    )
+    ledger_store = get_ledger_store()
+    ledger_jobs = {j["job"]: j for j in ledger_store.jobs(st.session_state.get("username", "operator"))}
+    resume_job = st.selectbox(
+        "Job ledger",
+        ["-- New job --", *ledger_jobs],
+        format_func=lambda job: job if job not in ledger_jobs else (
+            f"Resume {job} · {ledger_jobs[job]['label']} · "
+            f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(ledger_jobs[job]['created']))}"
+        ),
+        help="Every run records its progress under a new ledger job. Resuming an interrupted job "
+             "skips the stages it already finished; it needs the settings the job was started with."
+    )
+    if resume_job in ledger_jobs:
+        ledger_col, discard_col = st.columns([4, 1])
+        ledger_col.caption("Ledger: " + " · ".join(f"{k} {v}" for k, v in ledger_jobs[resume_job]["stages"].items()))
+        if discard_col.button("Discard job"):
+            ledger_store.delete(resume_job)
+            st.experimental_rerun()
+    force_regenerate = st.checkbox(
+        "Force regenerate descriptions",
+        help="Ignore cached GPT descriptions and call the model for every product."
+    )
+
     # -----------------------------------
     # Run upload
     # -----------------------------------
-    if st.button("Run Upload"):
-        if not urls_to_process:
-            st.warning("Please enter a URL or upload a file.")
-            return
-
+    run_clicked = st.button("Run Upload")
+    first_url = None
+    if run_clicked:
+        # An uploaded file is read lazily; peek at its first URL so an empty
+        # (or header-only) file is caught here instead of queueing an empty job
+        remaining = iter(urls_to_process)
+        first_url = next(remaining, None)
+        urls_to_process = itertools.chain([first_url], remaining)
+    if run_clicked and first_url is None:
+        st.warning("Please enter a URL or upload a file.")
+    elif run_clicked:
         # Convert selections into IDs
         coll_ids = [coll_dict[name] for name in sel_coll]
         del_id   = del_dict.get(del_choice) if del_choice != "-- None --" else None
         siz_id   = siz_dict.get(siz_choice) if siz_choice != "-- None --" else None
 
         # Fetch navigation URLs once
-        collection_urls, product_urls = get_navigation_links()
-
-        def process_one(product_url):
-            p_data = scrape_product(product_url)
-
-            # GPT-enhanced description
-            category_list = [c.strip() for c in categories_input.split(",") if c.strip()]
-            related_list  = [r.strip() for r in related_products_input.split(",") if r.strip()]
-
-            p_data["enhanced_description"] = enhance_description_via_gpt(
-                raw_description   = p_data["raw_description"],
-                product_title     = p_data["title"],
-                vendor            = p_data["vendor"],
-                product_type      = sel_type,
-                categories        = category_list,
-                related_products  = related_list,
-                collection        = collection,
-                collection_urls   = collection_urls,
-                product_urls      = product_urls
-            )
-
-            # Assign type and tags
-            p_data["productType"] = sel_type
-            p_data["tags"]        = sel_tags
-
-            # Create product & variants
-            product_id, inv_ids = create_product_with_variants(p_data)
-            if not product_id:
-                return
-
-            # Metafields & inventory
-            update_product_category(product_id)
-            update_faqs_metafield(product_id)
-            update_we_care_and_disclaimer(product_id)
-            update_delivery_and_size_chart_metafields(product_id, del_id, siz_id)
-
-            enable_inventory_tracking(inv_ids)
-            activate_inventory(inv_ids)
-            set_inventory_quantity(inv_ids)
-            upload_media(product_id, p_data)
-
-            # Publish & add to collections
-            publication_ids = get_publication_ids()
-            publish_product(product_id, publication_ids)
-            add_product_to_collections(product_id, coll_ids)
+        links = get_navigation_links()
+
+        opts = run_options(
+            sel_type,
+            tags             = sel_tags,
+            coll_ids         = coll_ids,
+            del_id           = del_id,
+            siz_id           = siz_id,
+            categories       = [c.strip() for c in categories_input.split(",") if c.strip()],
+            related_products = [r.strip() for r in related_products_input.split(",") if r.strip()],
+            collection       = collection,
+            links            = links,
+            write_mode       = WRITE_MODES[write_mode],
+            publication_ids  = get_publication_ids(),
+            force_regenerate = force_regenerate,
+            llm_mode         = LLM_MODES[llm_mode],
+            llm_limits       = (llm_concurrency, llm_rpm, llm_tpm),
+            preflight        = preflight,
+            defer_finalize   = defer_finalize,
+        )
 
-            st.success(f"Uploaded: {p_data['title']}")
+        owner = st.session_state.get("username", "operator")
+        label = uploaded_file.name if uploaded_file else first_url
+        try:
+            # A price re-sync has no stages to resume, so only uploads get a ledger job
+            if not resync_only and resume_job in ledger_jobs:
+                opts["ledger"] = ledger_store.resume(resume_job, opts)
+            elif not resync_only:
+                opts["ledger"] = ledger_store.start(owner, label, opts)
+        except ValueError as exc:
+            st.error(str(exc))
+        else:
+            job_id = get_job_runner().submit(owner, label, urls_to_process, opts, workers, resync=resync_only)
+            ledger = f" (ledger {opts['ledger'].job})" if "ledger" in opts else ""
+            st.success(f"Queued job #{job_id}{ledger}. It keeps running if you leave or reload this page.")
 
-        # Loop through each URL (product or collection)
-        for u in urls_to_process:
-            if "/products/" in u:
-                st.info(f"Single Product Mode: {u}")
-                process_one(u)
-            else:
-                st.info(f"Collection Mode: {u}")
-                for p_url in scrape_collection(u):
-                    process_one(p_url)
+    show_jobs()
 
 # -----------------------------------
 # 8. ENTRY POINT
 # -----------------------------------
 
 def run():
+    if "logged_in" not in st.session_state:
+        st.session_state.logged_in = False
     if not st.session_state.logged_in:
         login_screen()
     else:
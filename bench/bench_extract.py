@@ -0,0 +1,96 @@
+"""
+Micro-benchmark for product page parsing: the full BeautifulSoup walk that
+scrape_product used to do vs. the targeted lxml extractor it uses now.
+
+    python bench/bench_extract.py                 # every fixture in bench/fixtures
+    python bench/bench_extract.py --repeat 100 page.html
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import extract_product_html  # noqa: E402
+
+
+def legacy_extract(html):
+    """The previous scrape_product parsing, kept here as the baseline."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    product_data = {}
+    model_tag = soup.find(
+        "script",
+        {"type": "application/json",
+         "id":   lambda x: x and x.startswith("ModelJson-template")}
+    )
+    if model_tag and model_tag.string:
+        try:
+            loaded = json.loads(model_tag.string)
+            if isinstance(loaded, list) and loaded:
+                product_data = loaded[0]
+            elif isinstance(loaded, dict):
+                product_data = loaded
+        except Exception:
+            product_data = {}
+
+    if not product_data:
+        ld = soup.find("script", type="application/ld+json")
+        try:
+            product_data = json.loads(ld.string) if ld and ld.string else {}
+        except Exception:
+            product_data = {}
+
+    carousel = []
+    for img in soup.select("img.photoswipe__image"):
+        src = img.get("data-photoswipe-src") or img.get("src")
+        if not src:
+            continue
+        if src.startswith("//"):
+            src = "https:" + src
+        carousel.append(src)
+    return product_data, carousel
+
+
+def median_ms(fn, html, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(html)
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("fixtures", nargs="*",
+                        default=sorted(glob.glob(os.path.join(ROOT, "bench", "fixtures", "*.html"))))
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{'fixture':<28}{'KB':>8}{'legacy ms':>12}{'targeted ms':>14}{'speedup':>10}")
+    for path in args.fixtures:
+        with open(path, "rb") as fh:
+            html = fh.read()
+
+        # Both paths must agree before their timings mean anything
+        old_data, old_carousel = legacy_extract(html)
+        new_data, new_carousel = extract_product_html(html)
+        if old_data != new_data or old_carousel != new_carousel:
+            sys.exit(f"{path}: extractors disagree")
+
+        legacy   = median_ms(legacy_extract, html, args.repeat)
+        targeted = median_ms(extract_product_html, html, args.repeat)
+        print(f"{os.path.basename(path):<28}{len(html) / 1024:>8.0f}"
+              f"{legacy:>12.2f}{targeted:>14.2f}{legacy / targeted:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+End-to-end throughput of the upload pipeline against local stand-ins for
+Shopify, the source storefront and OpenAI (see fake_services.py), so a
+performance change can be measured without a real store or a paid LLM.
+
+    python bench/bench_pipeline.py                          # 10, 50 and 200 products
+    python bench/bench_pipeline.py --sizes 500 --workers 12 --llm-mode async
+    python bench/bench_pipeline.py --shopify-latency 0.15 --llm-latency 2 --json out.json
+
+Every size uses fresh product handles, so neither the scrape cache nor the
+description cache is warm. A run only counts if the pipeline did real work:
+the script exits non-zero when any product failed, logged a warning or error,
+or reached the store without variants, or a query went over Shopify's cost
+limit.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeOpenAI, FakeShopify, FakeStorefront  # noqa: E402
+
+STAGES = ("scrape", "images", "describe", "create", "metafields", "inventory", "media", "publish", "collections",
+          "publish_batch", "collections_batch")
+
+
+def start_services(args):
+    shopify    = FakeShopify(latency=args.shopify_latency, bucket_size=args.bucket_size,
+                             restore_rate=args.restore_rate)
+    storefront = FakeStorefront(latency=args.storefront_latency, products=max(args.sizes) * len(args.sizes))
+    llm        = FakeOpenAI(latency=args.llm_latency)
+
+    # app reads these at import / first use
+    os.environ["SHOPIFY_GRAPHQL_ENDPOINT"] = f"{shopify.url}/admin/api/graphql.json"
+    os.environ["SHOPIFY_ACCESS_TOKEN"]     = "bench"
+    os.environ["OPENAI_API_KEY"]           = "bench"
+    os.environ["OPENAI_BASE_URL"]          = f"{llm.url}/v1"
+    os.environ["UPLOADER_CACHE_DIR"]       = tempfile.mkdtemp(prefix="uploader-bench-")
+    return shopify, storefront, llm
+
+
+def bench_opts(app, args, metrics):
+    return app.run_options(
+        "Luxury Lawn",
+        tags             = ["bench"],
+        coll_ids         = ["gid://shopify/Collection/1", "gid://shopify/Collection/2"],
+        categories       = ["Lawn", "Embroidered"],
+        related_products = ["Embroidered Kurta"],
+        collection       = "Summer Lawn",
+        write_mode       = args.write_mode,
+        publication_ids  = ["gid://shopify/Publication/1"],
+        llm_mode         = args.llm_mode,
+        preflight        = args.preflight,
+        defer_finalize   = args.defer,
+        metrics          = metrics,
+    )
+
+
+def run_size(app, services, args, size, offset):
+    shopify, storefront, llm = services
+    for service in services:
+        service.counts.clear()
+    if args.via_collection:
+        # products.json lists handles from 0; give this size its own collection window
+        storefront.products = offset + size
+        urls = app.iter_product_urls([f"{storefront.url}/collections/bench"])
+        urls = (u for u in urls if int(u.rsplit("-", 1)[1]) >= offset)
+    else:
+        urls = (f"{storefront.url}/products/bench-{n}" for n in range(offset, offset + size))
+
+    metrics = app.Metrics()
+    started = time.monotonic()
+    results = app.run_batch(urls, bench_opts(app, args, metrics), workers=args.workers, on_result=metrics.finish)
+    elapsed = time.monotonic() - started
+
+    summary = metrics.summary()
+    stored = [shopify.products.get(app.product_handle(r["url"])) for r in results
+              if r["status"] in ("uploaded", "updated")]
+    report = {
+        "size":                size,
+        "seconds":             round(elapsed, 2),
+        "products_per_minute": round(len(results) / elapsed * 60, 1),
+        "failed":              sum(1 for r in results if r["status"] == "failed"),
+        "warnings":            sum(1 for r in results if any(level in ("warning", "error") for level, _ in r["messages"])),
+        "no_variants":         sum(1 for product in stored if not (product or {}).get("variants")),
+        "stages":              summary["stages"],
+        "requests":            {"shopify": dict(shopify.counts), "storefront": dict(storefront.counts),
+                                "openai": dict(llm.counts)},
+    }
+    if args.resync:
+        report["resync"] = run_resync(app, storefront, args, [r["url"] for r in results])
+    return report
+
+
+def run_resync(app, storefront, args, urls):
+    """Re-sync the products just uploaded after raising every source price."""
+    storefront.price_offset += 100
+    metrics = app.Metrics()
+    started = time.monotonic()
+    results = app.resync_prices(urls, workers=args.workers, on_result=metrics.finish, metrics=metrics)
+    elapsed = time.monotonic() - started
+    return {"seconds": round(elapsed, 2), "statuses": metrics.summary()["statuses"],
+            "products_per_minute": round(len(results) / elapsed * 60, 1)}
+
+
+def print_report(report):
+    print(f"\n=== {report['size']} products: {report['seconds']}s, "
+          f"{report['products_per_minute']} products/min, {report['failed']} failed, "
+          f"{report['warnings']} with warnings, {report['no_variants']} without variants")
+    print(f"{'stage':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'requests':>10}{'cost':>8}")
+    for stage in STAGES + tuple(sorted(set(report["stages"]) - set(STAGES))):
+        s = report["stages"].get(stage)
+        if not s:
+            continue
+        print(f"{stage:<18}{s['count']:>7}{(s['p50'] or 0) * 1000:>10.1f}{(s['p95'] or 0) * 1000:>10.1f}"
+              f"{s.get('requests', 0):>10}{s.get('shopify_cost', 0):>8}")
+    if "resync" in report:
+        resync = report["resync"]
+        statuses = ", ".join(f"{n} {status}" for status, n in sorted(resync["statuses"].items()))
+        print(f"{'resync':<18}{resync['seconds']}s, {resync['products_per_minute']} products/min: {statuses}")
+    for service, counts in report["requests"].items():
+        calls = ", ".join(f"{name} {n}" for name, n in sorted(counts.items()))
+        print(f"{service:<12}{sum(counts.values()):>6} requests  {calls}")
+
+
+def problems(report):
+    found = [f"{report[key]} {key.replace('_', ' ')}" for key in ("failed", "warnings", "no_variants") if report[key]]
+    if report.get("resync", {}).get("statuses", {}).get("failed"):
+        found.append(f"{report['resync']['statuses']['failed']} failed re-syncs")
+    if report["requests"]["shopify"].get("MAX_COST_EXCEEDED"):
+        found.append(f"{report['requests']['shopify']['MAX_COST_EXCEEDED']} queries over the cost limit")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=lambda v: [int(n) for n in v.split(",")], default=[10, 50, 200])
+    parser.add_argument("--workers", type=int, default=6)
+    parser.add_argument("--write-mode", choices=["productSet", "steps", "bulk"], default="productSet")
+    parser.add_argument("--llm-mode", choices=["inline", "async", "batch"], default="inline")
+    parser.add_argument("--preflight", action="store_true", help="include the handle pre-flight lookup")
+    parser.add_argument("--defer", action="store_true", help="batch publishing and collection adds")
+    parser.add_argument("--resync", action="store_true", help="then re-sync the uploaded products' prices")
+    parser.add_argument("--via-collection", action="store_true", help="discover products through a collection")
+    parser.add_argument("--shopify-latency", type=float, default=0.05, help="seconds per Admin API request")
+    parser.add_argument("--storefront-latency", type=float, default=0.03)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--bucket-size", type=int, default=1000)
+    parser.add_argument("--restore-rate", type=int, default=50)
+    parser.add_argument("--json", help="also write the reports here")
+    args = parser.parse_args()
+
+    services = start_services(args)
+
+    import headless  # noqa: F401  (must come before app)
+    import app
+    # The stand-ins finish bulk operations and description batches in well under a second
+    app.BULK_POLL_INTERVAL = app.DESCRIPTION_BATCH_POLL_INTERVAL = 0.2
+
+    reports, offset = [], 0
+    try:
+        for size in args.sizes:
+            report = run_size(app, services, args, size, offset)
+            print_report(report)
+            reports.append(report)
+            offset += size
+    finally:
+        for service in services:
+            service.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(reports, fh, indent=2)
+
+    invalid = [f"{r['size']} products: {', '.join(problems(r))}" for r in reports if problems(r)]
+    if invalid:
+        sys.exit("Benchmark invalid, the pipeline did not do its full work:\n  " + "\n  ".join(invalid))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+End-to-end check of bulk write mode against the local Shopify stand-in:
+staged upload, bulkOperationRunMutation, status polling and the result
+JSONL, for an operation that completes, for one that FAILS with only a
+partialDataUrl, and for a job resumed after it was interrupted. Exits
+non-zero on the first mismatch.
+
+    python bench/check_bulk.py
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeOpenAI, FakeShopify, FakeStorefront  # noqa: E402
+
+PRODUCTS = 6
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit(f"FAIL: {message}")
+    print(f"ok: {message}")
+
+
+def bulk_opts(app):
+    return app.run_options(
+        "Luxury Lawn",
+        tags            = ["bench"],
+        coll_ids        = ["gid://shopify/Collection/1"],
+        write_mode      = "bulk",
+        publication_ids = ["gid://shopify/Publication/1"],
+    )
+
+
+def main():
+    shopify, storefront, llm = FakeShopify(bulk_polls=2), FakeStorefront(products=2 * PRODUCTS + 2), FakeOpenAI()
+    os.environ["SHOPIFY_GRAPHQL_ENDPOINT"] = f"{shopify.url}/admin/api/graphql.json"
+    os.environ["SHOPIFY_ACCESS_TOKEN"]     = "check"
+    os.environ["OPENAI_API_KEY"]           = "check"
+    os.environ["OPENAI_BASE_URL"]          = f"{llm.url}/v1"
+    os.environ["UPLOADER_CACHE_DIR"]       = tempfile.mkdtemp(prefix="uploader-check-")
+
+    import headless  # noqa: F401  (must come before app)
+    import app
+    app.BULK_POLL_INTERVAL = 0.05
+
+    try:
+        # Completed operation: every product created from its result line, then finalized
+        urls = [f"{storefront.url}/products/bench-{n}" for n in range(PRODUCTS)]
+        results = app.run_batch(urls, bulk_opts(app), workers=3)
+        check(len(results) == PRODUCTS, "completed: one result per product")
+        check(all(r["status"] == "uploaded" for r in results), "completed: every product uploaded")
+        check(shopify.counts.get("staged upload") == 1, "completed: one staged upload")
+        check(shopify.counts.get("bulkOperationRunMutation") == 1, "completed: one bulk operation")
+        check(shopify.counts.get("node", 0) >= 3, "completed: polled while RUNNING")
+        check(all(len(shopify.products[f"bench-{n}"]["variants"]) == 3 for n in range(PRODUCTS)),
+              "completed: products created with their variants")
+        check(shopify.counts.get("productPublish") == PRODUCTS, "completed: every product published")
+
+        # Failed operation: only the lines in partialDataUrl count as created
+        shopify.bulk_fail_after = PRODUCTS // 2
+        shopify.counts.clear()
+        urls = [f"{storefront.url}/products/bench-{n}" for n in range(PRODUCTS, 2 * PRODUCTS)]
+        results = {r["url"]: r for r in app.run_batch(urls, bulk_opts(app), workers=3)}
+        statuses = [results[url]["status"] for url in urls]
+        check(statuses == ["uploaded"] * (PRODUCTS // 2) + ["failed"] * (PRODUCTS - PRODUCTS // 2),
+              "failed: lines in the partial file uploaded, the rest failed")
+        check(all("No result line" in results[url]["error"] for url in urls[PRODUCTS // 2:]),
+              "failed: missing lines reported per product")
+        check(shopify.counts.get("productPublish") == PRODUCTS // 2, "failed: only created products published")
+
+        # Resumed job: products created before the crash are finalized, not skipped
+        # as unchanged by the pre-flight
+        shopify.bulk_fail_after = None
+        urls = [f"{storefront.url}/products/bench-{n}" for n in range(2 * PRODUCTS, 2 * PRODUCTS + 2)]
+        store, publish = app.get_ledger_store(), app.publish_product
+        opts = dict(bulk_opts(app), preflight=True)
+        opts["ledger"] = store.start("check", "resume", opts)
+
+        def crash(*args):
+            raise RuntimeError("interrupted")
+
+        app.publish_product = crash
+        results = app.run_batch(urls, opts, workers=1)
+        app.publish_product = publish
+        check(all(r["status"] == "failed" for r in results), "resumed: first run interrupted")
+        shopify.counts.clear()
+        opts = dict(bulk_opts(app), preflight=True, ledger=store.resume(opts["ledger"].job, opts))
+        results = app.run_batch(urls, opts, workers=1)
+        check(all(r["status"] == "uploaded" for r in results), "resumed: created products finished")
+        check(shopify.counts.get("bulkOperationRunMutation") is None, "resumed: nothing created again")
+        check(shopify.counts.get("productPublish") == len(urls), "resumed: every product published")
+    finally:
+        for service in (shopify, storefront, llm):
+            service.close()
+    print("all bulk checks passed")
+
+
+if __name__ == "__main__":
+    main()
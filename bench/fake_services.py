@@ -0,0 +1,489 @@
+"""
+Local stand-ins for the services the uploader talks to, for offline
+benchmarks: the Shopify Admin GraphQL API (with a query-cost bucket), a
+source storefront and an OpenAI-compatible chat completions endpoint.
+Each runs on its own ThreadingHTTPServer with a configurable latency and
+counts the requests it serves.
+"""
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class FakeService:
+    """Base class: a threaded HTTP server with request counters and latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.counts  = {}
+        self._lock   = threading.Lock()
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                service._dispatch(self, "GET")
+
+            def do_HEAD(self):
+                service._dispatch(self, "HEAD")
+
+            def do_POST(self):
+                service._dispatch(self, "POST")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _dispatch(self, request, method):
+        if self.latency:
+            time.sleep(self.latency)
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        status, content_type, payload = self.handle(method, request.path, body)
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(payload)))
+        request.end_headers()
+        if method != "HEAD":
+            request.wfile.write(payload)
+
+    def handle(self, method, path, body):
+        raise NotImplementedError
+
+
+def _connection(nodes):
+    return {"pageInfo": {"hasNextPage": False, "endCursor": None}, "edges": [{"node": n} for n in nodes]}
+
+
+def multipart_fields(body):
+    """{name: value bytes} of a multipart/form-data body."""
+    boundary = body.split(b"\r\n", 1)[0]
+    fields = {}
+    for part in body.split(boundary)[1:-1]:
+        head, _, value = part.partition(b"\r\n\r\n")
+        name = re.search(rb'name="([^"]+)"', head).group(1).decode()
+        fields[name] = value[:-2]   # drop the CRLF before the next boundary
+    return fields
+
+
+def _json(data, status=200):
+    return status, "application/json", json.dumps(data).encode("utf-8")
+
+
+# -----------------------------------
+# Shopify Admin GraphQL
+# -----------------------------------
+
+_STRING  = re.compile(r'"(?:\\.|[^"\\])*"')
+_FIELD   = re.compile(r"(\w+)\s*:\s*(\w+)|(\w+)")
+
+
+def top_level_fields(query):
+    """(alias, field) for every top-level selection of a GraphQL document."""
+    query = _STRING.sub('""', query)
+    body = query[query.index("{") + 1:]
+    depth, parens, outer = 0, 0, []
+    for ch in body:
+        if ch == "(":
+            parens += 1
+        elif ch == ")":
+            parens -= 1
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+        elif depth == 0 and parens == 0:
+            outer.append(ch)
+    fields = []
+    for alias, field, bare in _FIELD.findall("".join(outer)):
+        fields.append((alias, field) if field else (bare, bare))
+    return fields
+
+
+_PAGE_SIZE = re.compile(r"(?<!\$)\b(?:first|last)\s*:\s*(\$?\w+)")
+
+
+def connection_cost(query, variables):
+    """
+    Shopify's requested cost of a document's connections: each connection's
+    page size times the page sizes of the connections it is nested in,
+    summed, so `products(first: 25) { variants(first: 50) }` is 25 + 1250.
+    """
+    query = _STRING.sub('""', query)
+    total, stack, page, i = 0, [1], None, 0
+    while i < len(query):
+        ch = query[i]
+        if ch == "(":
+            end = query.index(")", i)
+            match = _PAGE_SIZE.search(query, i, end)
+            if match:
+                size = match.group(1)
+                page = int(variables.get(size[1:], 0) if size.startswith("$") else size)
+            i = end
+        elif ch == "{":
+            stack.append(stack[-1] * (page or 1))
+            total += stack[-1] if page else 0
+            page = None
+        elif ch == "}":
+            stack.pop()
+        i += 1
+    return total
+
+
+class FakeShopify(FakeService):
+    """
+    Admin GraphQL stand-in. Mutations cost `mutation_cost` and reads
+    `query_cost` from a leaky bucket of `bucket_size` points refilled at
+    `restore_rate`/s; a request that doesn't fit is answered THROTTLED, the
+    way Shopify does. A document whose nested connections cost more than
+    `max_cost` (see connection_cost) is refused MAX_COST_EXCEEDED before it
+    touches the bucket. Products written with productSet are kept by handle,
+    so `products(query: "handle:...")` finds them and
+    productVariantsBulkUpdate reprices them; every other mutation succeeds
+    with empty userErrors.
+
+    Bulk mutations are simulated end to end: stagedUploadsCreate points at
+    a local upload target, bulkOperationRunMutation runs productSet for every
+    line of the uploaded JSONL, and `node(id:)` reports the operation RUNNING
+    for `bulk_polls` polls before it finishes. With `bulk_fail_after` set the
+    operation ends FAILED with only a partialDataUrl, covering that many lines.
+    """
+
+    def __init__(self, latency=0.0, bucket_size=1000, restore_rate=50, mutation_cost=10, query_cost=2,
+                 bulk_polls=1, bulk_fail_after=None, max_cost=1000):
+        super().__init__(latency)
+        self.max_cost      = max_cost
+        self.bucket_size   = bucket_size
+        self.restore_rate  = restore_rate
+        self.mutation_cost = mutation_cost
+        self.query_cost    = query_cost
+        self._available    = float(bucket_size)
+        self._refilled     = time.monotonic()
+        self._ids          = 0
+        self.products      = {}   # handle -> product node
+        self.bulk_polls      = bulk_polls
+        self.bulk_fail_after = bulk_fail_after
+        self.staged          = {}   # staged upload key -> uploaded bytes
+        self.operations      = {}   # bulk operation id -> {"polls", "rows"}
+
+    def _next_id(self, kind):
+        with self._lock:
+            self._ids += 1
+            return f"gid://shopify/{kind}/{self._ids}"
+
+    def _spend(self, cost):
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.bucket_size, self._available + (now - self._refilled) * self.restore_rate)
+            self._refilled = now
+            ok = cost <= self._available
+            if ok:
+                self._available -= cost
+            return ok, self._available
+
+    def handle(self, method, path, body):
+        if path.startswith("/staged-uploads"):
+            return self.receive_upload(body)
+        if path.startswith("/bulk-results/"):
+            return self.bulk_result_file(path)
+        payload = json.loads(body or b"{}")
+        query = payload.get("query", "")
+        variables = payload.get("variables") or {}
+        is_mutation = query.lstrip().startswith("mutation")
+        fields = top_level_fields(query)
+        requested = connection_cost(query, variables)
+        if requested > self.max_cost:
+            self.count("MAX_COST_EXCEEDED")
+            return _json({"errors": [{
+                "message": f"Query cost is {requested}, which exceeds the single query max cost "
+                           f"limit ({self.max_cost}).",
+                "extensions": {"code": "MAX_COST_EXCEEDED", "cost": requested, "maxCost": self.max_cost},
+            }]})
+        cost = len(fields) * (self.mutation_cost if is_mutation else self.query_cost)
+
+        ok, available = self._spend(cost)
+        throttle_status = {
+            "maximumAvailable":   self.bucket_size,
+            "currentlyAvailable": int(available),
+            "restoreRate":        self.restore_rate,
+        }
+        if not ok:
+            self.count("THROTTLED")
+            return _json({
+                "errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}],
+                "extensions": {"cost": {"requestedQueryCost": cost, "actualQueryCost": None,
+                                        "throttleStatus": throttle_status}},
+            })
+
+        data = {}
+        for alias, field in fields:
+            self.count(field)
+            # GraphQLBatcher names each alias's variables v{n}_{argument}
+            scoped = {k[len(alias) + 1:]: v for k, v in variables.items() if k.startswith(alias + "_")}
+            data[alias] = self.resolve(field, scoped or variables)
+        return _json({
+            "data": data,
+            "extensions": {"cost": {"requestedQueryCost": cost, "actualQueryCost": cost,
+                                    "throttleStatus": throttle_status}},
+        })
+
+    def resolve(self, field, variables):
+        if field == "productSet":
+            return self.product_set(next((v for v in variables.values() if isinstance(v, dict)), {}))
+        if field == "productVariantsBulkUpdate":
+            updates = {v["id"]: v for v in next(v for v in variables.values() if isinstance(v, list))}
+            with self._lock:
+                for product in self.products.values():
+                    for variant in product["variants"]:
+                        variant.update({k: updates[variant["id"]][k] for k in ("price", "compareAtPrice")
+                                        if variant["id"] in updates})
+            return {"userErrors": []}
+        if field == "stagedUploadsCreate":
+            key = f"tmp/bulk/{self._next_id('StagedUpload').rsplit('/', 1)[1]}/{variables['input'][0]['filename']}"
+            return {"stagedTargets": [{"url": f"{self.url}/staged-uploads", "resourceUrl": f"{self.url}/{key}",
+                                       "parameters": [{"name": "key", "value": key}]}],
+                    "userErrors": []}
+        if field == "bulkOperationRunMutation":
+            return self.run_bulk(variables["p"])
+        if field == "node":
+            return self.bulk_status(variables["id"])
+        if field == "products" and "q" in variables:
+            handles = re.findall(r"handle:(\S+)", variables["q"])
+            with self._lock:
+                nodes = [self.products[h] for h in handles if h in self.products]
+            return _connection([{**n, "variants": _connection(n["variants"])} for n in nodes])
+        if field in ("products", "collections", "pages", "publications", "productTags"):
+            return _connection([])
+        return {"userErrors": []}
+
+    def receive_upload(self, body):
+        """The staged upload target: a multipart form with `key` and `file` fields."""
+        fields = multipart_fields(body)
+        self.count("staged upload")
+        self.staged[fields["key"].decode()] = fields["file"]
+        return 201, "text/plain", b""
+
+    def run_bulk(self, staged_path):
+        if staged_path not in self.staged:
+            return {"bulkOperation": None, "userErrors": [{"field": ["stagedUploadPath"], "message": "not found"}]}
+        rows = []
+        for n, line in enumerate(self.staged[staged_path].splitlines()):
+            rows.append({"data": {"productSet": self.product_set(json.loads(line)["input"])}, "__lineNumber": n})
+        operation_id = self._next_id("BulkOperation")
+        self.operations[operation_id] = {"polls": 0, "rows": rows}
+        return {"bulkOperation": {"id": operation_id, "status": "CREATED"}, "userErrors": []}
+
+    def bulk_status(self, operation_id):
+        operation = self.operations.get(operation_id)
+        if operation is None:
+            return None
+        operation["polls"] += 1
+        status = {"id": operation_id, "status": "RUNNING", "errorCode": None, "objectCount": "0",
+                  "url": None, "partialDataUrl": None}
+        if operation["polls"] <= self.bulk_polls:
+            return status
+        result_url = f"{self.url}/bulk-results/{operation_id.rsplit('/', 1)[1]}"
+        if self.bulk_fail_after is not None:
+            return {**status, "status": "FAILED", "errorCode": "INTERNAL_SERVER_ERROR",
+                    "objectCount": str(self.bulk_fail_after), "partialDataUrl": result_url}
+        return {**status, "status": "COMPLETED", "objectCount": str(len(operation["rows"])), "url": result_url}
+
+    def bulk_result_file(self, path):
+        operation = self.operations.get(f"gid://shopify/BulkOperation/{path.rsplit('/', 1)[1]}")
+        if operation is None:
+            return 404, "text/plain", b"not found"
+        rows = operation["rows"]
+        if self.bulk_fail_after is not None:
+            rows = rows[:self.bulk_fail_after]
+        self.count("bulk result file")
+        return 200, "application/jsonl", "".join(json.dumps(r) + "\n" for r in rows).encode("utf-8")
+
+    def product_set(self, product):
+        handle = product.get("handle")
+        with self._lock:
+            known = {v["id"] for v in self.products.get(handle, {}).get("variants", [])}
+        variants = []
+        for v in product.get("variants") or []:
+            variants.append({
+                "id":              v["id"] if v.get("id") in known else self._next_id("ProductVariant"),
+                "price":           v.get("price"),
+                "compareAtPrice":  v.get("compareAtPrice"),
+                "sku":             v.get("sku", ""),
+                "selectedOptions": [{"name": o["optionName"], "value": o["name"]} for o in v.get("optionValues", [])],
+            })
+        node = {"id": product.get("id") or self._next_id("Product"), "handle": handle,
+                "title": product.get("title"), "variants": variants}
+        if handle:
+            with self._lock:
+                self.products[handle] = node
+        edges = [{"node": {"id": v["id"], "inventoryItem": {"id": self._next_id("InventoryItem")}}}
+                 for v in variants]
+        return {"product": {"id": node["id"], "variants": {"edges": edges}}, "userErrors": []}
+
+
+# -----------------------------------
+# Source storefront
+# -----------------------------------
+
+class FakeStorefront(FakeService):
+    """
+    Serves `products` synthetic products (handles bench-0, bench-1, ...):
+    /products/{h}.js, the product page (from fixtures/product_page.html),
+    their images under /cdn/ and any collection as products.json pages and HTML.
+    """
+
+    def __init__(self, latency=0.0, products=100, prefix="bench"):
+        super().__init__(latency)
+        self.products = products
+        self.prefix   = prefix
+        self.price_offset = 0   # added to every source price, to simulate a price change
+        with open(os.path.join(FIXTURES, "product_page.html"), "rb") as fh:
+            self.product_page = fh.read()
+
+    def product_js(self, handle):
+        n = int(handle.rsplit("-", 1)[1])
+        return {
+            "title":       f"Embroidered Lawn Suit {n}",
+            "description": "<p>Three piece embroidered lawn suit.</p>" * 5,
+            # each image at two CDN sizes, like a theme's carousel and thumbnails
+            "images":      [f"{self.url}/cdn/shop/files/{handle}-{i}_{size}.jpg?v=1"
+                            for i in range(5) for size in ("1024x1024", "200x")],
+            "variants":    [
+                {"public_title": size, "price": 12000 + n + self.price_offset, "compare_at_price": 15000, "sku": f"{handle}-{size}"}
+                for size in ("S", "M", "L")
+            ],
+        }
+
+    def handle(self, method, path, body):
+        parts = urlsplit(path)
+        if parts.path.startswith("/cdn/"):
+            self.count("image")
+            return 200, "image/jpeg", b"\xff\xd8\xff\xe0" + b"\0" * 20_000
+        if parts.path.startswith("/products/") and parts.path.endswith(".js"):
+            self.count("product.js")
+            return _json(self.product_js(parts.path[len("/products/"):-3]))
+        if parts.path.startswith("/products/"):
+            self.count("product page")
+            return 200, "text/html", self.product_page
+        if parts.path.endswith("/products.json"):
+            self.count("products.json")
+            query = parse_qs(parts.query)
+            limit = int(query.get("limit", ["30"])[0])
+            page  = int(query.get("page", ["1"])[0])
+            handles = [f"{self.prefix}-{n}" for n in range((page - 1) * limit, min(page * limit, self.products))]
+            return _json({"products": [{"handle": h} for h in handles]})
+        if parts.path.startswith("/collections/"):
+            self.count("collection page")
+            links = "".join(f'<a href="/products/{self.prefix}-{n}">p</a>' for n in range(self.products))
+            return 200, "text/html", f"<html><body>{links}</body></html>".encode("utf-8")
+        return 404, "text/plain", b"not found"
+
+
+# -----------------------------------
+# OpenAI-compatible chat completions
+# -----------------------------------
+
+class FakeOpenAI(FakeService):
+    """
+    Answers /v1/chat/completions with a canned description and token usage,
+    and runs the Batch API (/v1/files, /v1/batches) over the same answers:
+    a batch stays in_progress for `batch_latency` seconds after it's created.
+    """
+
+    def __init__(self, latency=0.0, completion_tokens=400, batch_latency=0.5):
+        super().__init__(latency)
+        self.completion_tokens = completion_tokens
+        self.batch_latency     = batch_latency
+        self.files   = {}   # file id -> (filename, bytes)
+        self.batches = {}   # batch id -> batch object
+
+    def handle(self, method, path, body):
+        path = urlsplit(path).path
+        if path.endswith("/chat/completions"):
+            self.count("chat.completions")
+            return _json(self.completion(json.loads(body)))
+        if path == "/v1/files" and method == "POST":
+            self.count("files.create")
+            return _json(self.store_file(body))
+        if path.startswith("/v1/files/") and path.endswith("/content"):
+            file_id = path.split("/")[3]
+            if file_id not in self.files:
+                return 404, "text/plain", b"not found"
+            return 200, "application/jsonl", self.files[file_id][1]
+        if path == "/v1/batches" and method == "POST":
+            self.count("batches.create")
+            return _json(self.create_batch(json.loads(body)))
+        if path.startswith("/v1/batches/"):
+            batch = self.batches.get(path.rsplit("/", 1)[1])
+            return _json(self.batch_status(batch)) if batch else (404, "text/plain", b"not found")
+        return 404, "text/plain", b"not found"
+
+    def completion(self, request):
+        prompt_tokens = sum(len(m["content"]) for m in request["messages"]) // 4
+        return {
+            "id":      "chatcmpl-bench",
+            "object":  "chat.completion",
+            "created": int(time.time()),
+            "model":   request["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "<p>Benchmark description.</p>"}}],
+            "usage":   {"prompt_tokens": prompt_tokens, "completion_tokens": self.completion_tokens,
+                        "total_tokens": prompt_tokens + self.completion_tokens},
+        }
+
+    def _file_object(self, file_id, purpose):
+        filename, data = self.files[file_id]
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def store_file(self, body):
+        fields = multipart_fields(body)
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = ("batch.jsonl", fields["file"])
+        return self._file_object(file_id, fields.get("purpose", b"batch").decode())
+
+    def create_batch(self, request):
+        batch_id = f"batch_{len(self.batches) + 1}"
+        lines = [json.loads(line) for line in self.files[request["input_file_id"]][1].splitlines() if line.strip()]
+        output = "".join(json.dumps({
+            "id":        f"batch_req_{n}",
+            "custom_id": line["custom_id"],
+            "response":  {"status_code": 200, "request_id": f"req_{n}", "body": self.completion(line["body"])},
+            "error":     None,
+        }) + "\n" for n, line in enumerate(lines))
+        output_id = f"file-{len(self.files) + 1}"
+        self.files[output_id] = ("batch_output.jsonl", output.encode("utf-8"))
+        self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+            "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+            "created_at": int(time.time()), "status": "in_progress", "output_file_id": None,
+            "error_file_id": None, "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+            "_output": output_id, "_ready": time.monotonic() + self.batch_latency,
+        }
+        return self.batch_status(self.batches[batch_id])
+
+    def batch_status(self, batch):
+        if batch["status"] == "in_progress" and time.monotonic() >= batch["_ready"]:
+            total = batch["request_counts"]["total"]
+            batch.update(status="completed", output_file_id=batch["_output"],
+                         request_counts={"total": total, "completed": total, "failed": 0})
+        return {k: v for k, v in batch.items() if not k.startswith("_")}
@@ -0,0 +1,230 @@
+"""
+Headless entry point: the same scrape / describe / upload pipeline as the
+Streamlit app, without its runtime or login, for cron jobs and containers.
+
+    python cli.py upload urls.txt --config job.toml
+    cat urls.txt | python cli.py upload - --shard 0/4 --workers 12
+    python cli.py resync products.txt
+    python cli.py scrape https://example.com/products/some-dress
+    python cli.py upload https://example.com/collections/new-in --config job.toml
+
+Secrets come from the environment (SHOPIFY_ACCESS_TOKEN, OPENAI_API_KEY,
+optionally SHOPIFY_SHOP / OPENAI_BASE_URL), falling back to
+.streamlit/secrets.toml. Job settings come from a TOML / YAML / JSON file
+(--config, or $UPLOADER_CONFIG) and can be overridden by flags. Results are
+written to stdout as JSON lines, one per product; progress goes to stderr.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import headless  # noqa: F401  (must come before app)
+import app
+
+# Job settings understood in a --config file, with their defaults
+CONFIG_DEFAULTS = {
+    "product_type":     "Casual Pret",
+    "tags":             [],
+    "collections":      [],      # collection titles to add products to
+    "delivery_page":    None,    # page titles for the page-reference metafields
+    "size_page":        None,
+    "categories":       [],
+    "related_products": [],
+    "collection":       "",      # collection name used in the description prompt
+    "write_mode":       "productSet",
+    "llm_mode":         "inline",
+    "llm_concurrency":  app.LLM_CONCURRENCY,
+    "llm_rpm":          app.LLM_RPM_LIMIT,
+    "llm_tpm":          app.LLM_TPM_LIMIT,
+    "workers":          app.DEFAULT_WORKERS,
+    "preflight":        True,
+    "defer_finalize":   True,
+    "resume":           None,    # ledger job to resume; a new one is started otherwise
+    "force_regenerate": False,
+}
+
+
+def load_config(path):
+    """Job settings from a .toml, .yaml/.yml or .json file, over CONFIG_DEFAULTS."""
+    config = dict(CONFIG_DEFAULTS)
+    if not path:
+        return config
+    if path.endswith(".toml"):
+        import tomllib
+        with open(path, "rb") as fh:
+            loaded = tomllib.load(fh)
+    elif path.endswith((".yaml", ".yml")):
+        import yaml
+        with open(path, encoding="utf-8") as fh:
+            loaded = yaml.safe_load(fh) or {}
+    else:
+        with open(path, encoding="utf-8") as fh:
+            loaded = json.load(fh)
+    unknown = set(loaded) - set(CONFIG_DEFAULTS)
+    if unknown:
+        raise SystemExit(f"{path}: unknown settings {sorted(unknown)}")
+    config.update(loaded)
+    return config
+
+
+def iter_input_urls(paths):
+    """
+    URLs from the given txt / csv / .gz files ('-' for stdin), read lazily.
+    An argument that is itself a URL is passed through as one.
+    """
+    for path in paths or ["-"]:
+        if "://" in path:
+            yield path
+        elif path == "-":
+            yield from app.iter_url_file(sys.stdin.buffer)
+        else:
+            with open(path, "rb") as fh:
+                yield from app.iter_url_file(fh, path)
+
+
+def parse_shard(value):
+    index, _, count = value.partition("/")
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError("expected i/n with 0 <= i < n")
+    return index, count
+
+
+def in_shard(url, shard):
+    """Stable URL -> shard assignment, so every machine agrees without coordination."""
+    if shard is None:
+        return True
+    index, count = shard
+    return int(hashlib.md5(url.encode("utf-8")).hexdigest(), 16) % count == index
+
+
+def headless_opts(config):
+    """The opts dict main_app builds from its widgets, built from job settings instead."""
+    collections, _tags = app.fetch_collections_and_tags()
+    delivery_pages, size_pages = app.fetch_and_filter_pages()
+    coll_dict = {c["node"]["title"]: c["node"]["id"] for c in collections}
+    del_dict  = {p["title"]: p["id"] for p in delivery_pages}
+    siz_dict  = {p["title"]: p["id"] for p in size_pages}
+
+    missing = [name for name in config["collections"] if name not in coll_dict]
+    if missing:
+        raise SystemExit(f"Unknown (or smart) collections: {missing}")
+    for key, pages in (("delivery_page", del_dict), ("size_page", siz_dict)):
+        if config[key] is not None and config[key] not in pages:
+            raise SystemExit(f"Unknown {key.replace('_', ' ')}: {config[key]!r}")
+
+    return app.run_options(
+        config["product_type"],
+        tags             = config["tags"],
+        coll_ids         = [coll_dict[name] for name in config["collections"]],
+        del_id           = del_dict.get(config["delivery_page"]),
+        siz_id           = siz_dict.get(config["size_page"]),
+        categories       = config["categories"],
+        related_products = config["related_products"],
+        collection       = config["collection"],
+        links            = app.get_navigation_links(),
+        write_mode       = config["write_mode"],
+        publication_ids  = app.get_publication_ids(),
+        force_regenerate = config["force_regenerate"],
+        llm_mode         = config["llm_mode"],
+        llm_limits       = (config["llm_concurrency"], config["llm_rpm"], config["llm_tpm"]),
+        preflight        = config["preflight"],
+        defer_finalize   = config["defer_finalize"],
+    )
+
+
+def emit(result):
+    print(json.dumps(result, ensure_ascii=False), flush=True)
+
+
+def cmd_scrape(args, config):
+    failed = 0
+    for url in app.iter_product_urls(iter_input_urls(args.inputs)):
+        if not in_shard(url, args.shard):
+            continue
+        try:
+            emit({"url": url, **app.scrape_product(url)})
+        except Exception as exc:
+            failed += 1
+            emit({"url": url, "error": f"{type(exc).__name__}: {exc}"})
+    return failed
+
+
+def write_metrics(metrics, path):
+    """Metrics as Prometheus text for a .prom path, JSON otherwise."""
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write(metrics.to_prometheus() if path.endswith(".prom") else metrics.to_json())
+
+
+def cmd_upload(args, config):
+    product_urls = (u for u in app.iter_product_urls(iter_input_urls(args.inputs)) if in_shard(u, args.shard))
+    metrics = app.Metrics()
+
+    def on_result(result):
+        metrics.finish(result)
+        emit(result)
+
+    if args.command == "resync":
+        results = app.resync_prices(product_urls, workers=config["workers"], on_result=on_result, metrics=metrics)
+    else:
+        opts = {**headless_opts(config), "metrics": metrics}
+        store = app.get_ledger_store()
+        try:
+            if config["resume"]:
+                opts["ledger"] = store.resume(config["resume"], opts)
+            else:
+                opts["ledger"] = store.start(os.environ.get("USER", "cli"), ", ".join(args.inputs) or "stdin", opts)
+        except ValueError as exc:
+            raise SystemExit(str(exc))
+        # Needed to resume this run with --resume if it is interrupted
+        print(f"ledger job {opts['ledger'].job}", file=sys.stderr, flush=True)
+        results = app.run_batch(product_urls, opts, workers=config["workers"], on_result=on_result)
+    if args.metrics_out:
+        write_metrics(metrics, args.metrics_out)
+
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    app.log.info(", ".join(f"{n} {status}" for status, n in sorted(counts.items())) or "No products")
+    return counts.get("failed", 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["upload", "resync", "scrape"])
+    parser.add_argument("inputs", nargs="*", help="product / collection URLs, or files of them; '-' or none reads stdin")
+    parser.add_argument("--config", default=os.environ.get("UPLOADER_CONFIG"))
+    parser.add_argument("--shard", type=parse_shard, help="only process shard i of n (0-based), e.g. 2/8")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--write-mode", choices=["productSet", "steps", "bulk"])
+    parser.add_argument("--llm-mode", choices=["inline", "async", "batch"])
+    parser.add_argument("--no-preflight", action="store_true")
+    parser.add_argument("--resume", metavar="JOB", help="resume an interrupted run's ledger job")
+    parser.add_argument("--force-regenerate", action="store_true")
+    parser.add_argument("--metrics-out", help="write per-stage metrics here (.prom: Prometheus text, else JSON)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    config = load_config(args.config)
+    for key, value in (("workers", args.workers), ("write_mode", args.write_mode), ("llm_mode", args.llm_mode)):
+        if value is not None:
+            config[key] = value
+    if args.no_preflight:
+        config["preflight"] = False
+    if args.resume:
+        config["resume"] = args.resume
+    if args.force_regenerate:
+        config["force_regenerate"] = True
+
+    failed = cmd_scrape(args, config) if args.command == "scrape" else cmd_upload(args, config)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
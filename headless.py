@@ -0,0 +1,10 @@
+"""
+Streamlit settings for importing app outside `streamlit run`, as cli.py and
+the bench scripts do. Import this module before app.
+"""
+import streamlit.config
+import streamlit.logger
+
+# Streamlit warns about running without its runtime on every cached call
+streamlit.config.set_option("global.showWarningOnDirectExecution", False)
+streamlit.logger.set_log_level("error")